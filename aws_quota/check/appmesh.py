@@ -4,10 +4,10 @@ from .quota_check import QuotaCheck, QuotaScope
 class MeshCountCheck(QuotaCheck):
     key = "am_mesh_count"
     description = "App Meshes per account"
-    scope = QuotaScope.ACCOUNT
+    scope = QuotaScope.REGION
     service_code = 'appmesh'
     quota_code = 'L-AC861A39'
 
     @property
     def current(self):
-        return len(self.boto_session.client('appmesh').list_meshes()['meshes'])
+        return self.count_paginated_results('appmesh', 'list_meshes', 'meshes')
@@ -1,13 +1,24 @@
+from aws_quota.utils import get_client
+import typing
+
+import boto3
 from .quota_check import QuotaCheck, QuotaScope
 
 
+def get_undeleted_stack_statuses(session: boto3.Session) -> typing.List[str]:
+    statuses = get_client(session, 'cloudformation').meta.service_model.shape_for('StackStatus').enum
+    return [status for status in statuses if status != 'DELETE_COMPLETE']
+
+
 class StackCountCheck(QuotaCheck):
     key = "cf_stack_count"
     description = "Cloud Formation Stack count"
-    scope = QuotaScope.ACCOUNT
+    scope = QuotaScope.REGION
     service_code = 'cloudformation'
     quota_code = 'L-0485CB21'
 
     @property
     def current(self):
-        return len(self.boto_session.client('cloudformation').list_stacks()['StackSummaries'])
+        return self.count_paginated_results('cloudformation', 'list_stacks', 'StackSummaries', {
+            'StackStatusFilter': get_undeleted_stack_statuses(self.boto_session)
+        })
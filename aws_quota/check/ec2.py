@@ -1,217 +1,237 @@
+from aws_quota.instance_types import get_instance_type_vcpus
+from aws_quota.inventory import inventory
+from aws_quota.utils import paginate
 from .quota_check import QuotaCheck, QuotaScope
 
+import collections
+import logging
+import re
+import typing
+
 import boto3
-import cachetools
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_FAMILY_PATTERN = re.compile(r'^[a-z]+')
+
+# families that count against the same quota, e.g. im4gn and is4gen instances are standard ones
+STANDARD_FAMILIES = frozenset(['a', 'c', 'd', 'h', 'i', 'im', 'is', 'm', 'r', 't', 'z'])
+G_FAMILIES = frozenset(['g', 'gr', 'vt'])
+
+
+def get_instance_family(instance_type: str) -> str:
+    """Returns the family prefix of an instance type, e.g. inf for inf1.xlarge or c for c5n.large"""
+    match = INSTANCE_FAMILY_PATTERN.match(instance_type)
+    return match.group(0) if match else instance_type
+
+
+@inventory.cached('ec2:running-instance-types')
+def get_running_instance_type_counts(session: boto3.Session) -> typing.Counter[str]:
+    return collections.Counter(
+        instance['InstanceType']
+        for reservation in paginate(
+            session, 'ec2', 'describe_instances', 'Reservations', page_size=1000,
+            Filters=[{'Name': 'instance-state-name', 'Values': ['running']}]
+        )
+        for instance in reservation['Instances']
+    )
+
+
+@inventory.cached('ec2:spot-instance-request-types')
+def get_spot_request_instance_type_counts(session: boto3.Session) -> typing.Counter[str]:
+    return collections.Counter(
+        request['LaunchSpecification']['InstanceType']
+        for request in paginate(
+            session, 'ec2', 'describe_spot_instance_requests', 'SpotInstanceRequests', page_size=1000,
+            Filters=[{'Name': 'state', 'Values': ['open', 'active']}]
+        )
+        if 'InstanceType' in request.get('LaunchSpecification', {})
+    )
 
 
-@cachetools.cached(cache=cachetools.TTLCache(1, 60))
-def get_all_running_ec2_instances(session: boto3.Session):
-    return [instance for reservations in session.client('ec2').describe_instances(
-            Filters=[
-                {
-                    'Name': 'instance-state-name',
-                    'Values': ['running']
-                }
-            ]
-            )['Reservations'] for instance in reservations['Instances']]
+def count_vcpus(session: boto3.Session, instance_type_counts: typing.Counter[str], families: typing.Iterable[str]) -> int:
+    """Sums the vCPUs of all instances whose type belongs to one of families
 
+    Instances of types whose vCPU count is unknown in the session's region are skipped.
+    """
+    instance_type_counts = {instance_type: count for instance_type, count in instance_type_counts.items()
+                            if get_instance_family(instance_type) in families}
+    vcpus = get_instance_type_vcpus(session, instance_type_counts.keys())
+    unknown = sorted(set(instance_type_counts).difference(vcpus))
 
-@cachetools.cached(cache=cachetools.TTLCache(1, 60))
-def get_all_spot_requests(session: boto3.Session):
-    return session.client('ec2').describe_spot_instance_requests()[
-        'SpotInstanceRequests']
+    if unknown:
+        logger.warning('instances of types %s in region %s are not counted, their vCPU count is unknown',
+                       ', '.join(unknown), session.region_name)
+
+    return sum(count * vcpus[instance_type] for instance_type, count in instance_type_counts.items() if instance_type in vcpus)
 
 
 class OnDemandStandardInstanceCountCheck(QuotaCheck):
     key = "ec2_on_demand_standard_count"
-    description = "Running On-Demand Standard (A, C, D, H, I, M, R, T, Z) EC2 instances"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of running On-Demand Standard (A, C, D, H, I, M, R, T, Z) EC2 instances"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-1216C47A"
 
     @property
     def current(self):
-        instances = get_all_running_ec2_instances(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['InstanceType'][0] in ['a', 'c', 'd', 'h', 'i', 'm', 'r', 't', 'z'], instances)))
+        return count_vcpus(self.boto_session, get_running_instance_type_counts(self.boto_session), STANDARD_FAMILIES)
 
 
 class OnDemandFInstanceCountCheck(QuotaCheck):
     key = "ec2_on_demand_f_count"
-    description = "Running On-Demand F EC2 instances"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of running On-Demand F EC2 instances"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-74FC7D96"
 
     @property
     def current(self):
-        instances = get_all_running_ec2_instances(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['InstanceType'][0] in ['f'], instances)))
+        return count_vcpus(self.boto_session, get_running_instance_type_counts(self.boto_session), ['f'])
 
 
 class OnDemandGInstanceCountCheck(QuotaCheck):
     key = "ec2_on_demand_g_count"
-    description = "Running On-Demand G EC2 instances"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of running On-Demand G EC2 instances"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-DB2E81BA"
 
     @property
     def current(self):
-        instances = get_all_running_ec2_instances(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['InstanceType'][0] in ['g'], instances)))
+        return count_vcpus(self.boto_session, get_running_instance_type_counts(self.boto_session), G_FAMILIES)
 
 
 class OnDemandInfInstanceCountCheck(QuotaCheck):
     key = "ec2_on_demand_inf_count"
-    description = "Running On-Demand Inf EC2 instances"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of running On-Demand Inf EC2 instances"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-1945791B"
 
     @property
     def current(self):
-        instances = get_all_running_ec2_instances(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['InstanceType'][0] in ['inf'], instances)))
+        return count_vcpus(self.boto_session, get_running_instance_type_counts(self.boto_session), ['inf'])
 
 
 class OnDemandPInstanceCountCheck(QuotaCheck):
     key = "ec2_on_demand_p_count"
-    description = "Running On-Demand P EC2 instances"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of running On-Demand P EC2 instances"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-417A185B"
 
     @property
     def current(self):
-        instances = get_all_running_ec2_instances(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['InstanceType'][0] in ['p'], instances)))
+        return count_vcpus(self.boto_session, get_running_instance_type_counts(self.boto_session), ['p'])
 
 
 class OnDemandXInstanceCountCheck(QuotaCheck):
     key = "ec2_on_demand_x_count"
-    description = "Running On-Demand X EC2 instances"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of running On-Demand X EC2 instances"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-7295265B"
 
     @property
     def current(self):
-        instances = get_all_running_ec2_instances(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['InstanceType'][0] in ['x'], instances)))
+        return count_vcpus(self.boto_session, get_running_instance_type_counts(self.boto_session), ['x'])
 
 
 class SpotStandardRequestCountCheck(QuotaCheck):
     key = "ec2_spot_standard_count"
-    description = "All Standard (A, C, D, H, I, M, R, T, Z) EC2 Spot Instance Requests"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of open and active Standard (A, C, D, H, I, M, R, T, Z) EC2 Spot Instance Requests"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-34B43A08"
 
     @property
     def current(self):
-        requests = get_all_spot_requests(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['LaunchSpecification']['InstanceType'][0] in ['a', 'c', 'd', 'h', 'i', 'm', 'r', 't', 'z'], requests)))
+        return count_vcpus(self.boto_session, get_spot_request_instance_type_counts(self.boto_session), STANDARD_FAMILIES)
 
 
 class SpotFRequestCountCheck(QuotaCheck):
     key = "ec2_spot_f_count"
-    description = "All F EC2 Spot Instance Requests"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of open and active F EC2 Spot Instance Requests"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-88CF9481"
 
     @property
     def current(self):
-        requests = get_all_spot_requests(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['LaunchSpecification']['InstanceType'][0] in ['f'], requests)))
+        return count_vcpus(self.boto_session, get_spot_request_instance_type_counts(self.boto_session), ['f'])
 
 
 class SpotGRequestCountCheck(QuotaCheck):
     key = "ec2_spot_g_count"
-    description = "All G EC2 Spot Instance Requests"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of open and active G EC2 Spot Instance Requests"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-3819A6DF"
 
     @property
     def current(self):
-        requests = get_all_spot_requests(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['LaunchSpecification']['InstanceType'][0] in ['g'], requests)))
+        return count_vcpus(self.boto_session, get_spot_request_instance_type_counts(self.boto_session), G_FAMILIES)
 
 
 class SpotInfRequestCountCheck(QuotaCheck):
     key = "ec2_spot_inf_count"
-    description = "All Inf EC2 Spot Instance Requests"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of open and active Inf EC2 Spot Instance Requests"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-B5D1601B"
 
     @property
     def current(self):
-        requests = get_all_spot_requests(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['LaunchSpecification']['InstanceType'][0] in ['inf'], requests)))
+        return count_vcpus(self.boto_session, get_spot_request_instance_type_counts(self.boto_session), ['inf'])
 
 
 class SpotPRequestCountCheck(QuotaCheck):
     key = "ec2_spot_p_count"
-    description = "All P EC2 Spot Instance Requests"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of open and active P EC2 Spot Instance Requests"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-7212CCBC"
 
     @property
     def current(self):
-        requests = get_all_spot_requests(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['LaunchSpecification']['InstanceType'][0] in ['p'], requests)))
+        return count_vcpus(self.boto_session, get_spot_request_instance_type_counts(self.boto_session), ['p'])
 
 
 class SpotXRequestCountCheck(QuotaCheck):
     key = "ec2_spot_x_count"
-    description = "All X EC2 Spot Instance Requests"
-    scope = QuotaScope.ACCOUNT
+    description = "vCPUs of open and active X EC2 Spot Instance Requests"
+    scope = QuotaScope.REGION
     service_code = "ec2"
     quota_code = "L-E3A00192"
 
     @property
     def current(self):
-        requests = get_all_spot_requests(self.boto_session)
-
-        return len(list(filter(lambda inst: inst['LaunchSpecification']['InstanceType'][0] in ['x'], requests)))
+        return count_vcpus(self.boto_session, get_spot_request_instance_type_counts(self.boto_session), ['x'])
 
 
 class ElasticIpCountCheck(QuotaCheck):
     key = "ec2_eip_count"
     description = "EC2 VPC Elastic IPs"
-    scope = QuotaScope.ACCOUNT
+    scope = QuotaScope.REGION
     service_code = 'ec2'
     quota_code = 'L-0263D0A3'
 
     @property
     def current(self):
-        return len(self.boto_session.client('ec2').describe_addresses()['Addresses'])
+        return self.count_paginated_results('ec2', 'describe_addresses', 'Addresses')
 
 
 class TransitGatewayCountCheck(QuotaCheck):
     key = "ec2_tgw_count"
     description = "Transit Gateways per account"
-    scope = QuotaScope.ACCOUNT
+    scope = QuotaScope.REGION
     service_code = 'ec2'
     quota_code = 'L-A2478D36'
 
     @property
     def current(self):
-        return len(self.boto_session.client('ec2').describe_transit_gateways()['TransitGateways'])
+        return self.count_paginated_results('ec2', 'describe_transit_gateways', 'TransitGateways')
 
 
 class VpnConnectionCountCheck(QuotaCheck):
@@ -223,4 +243,4 @@ class VpnConnectionCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(self.boto_session.client('ec2').describe_vpn_connections()['VpnConnections'])
+        return self.count_paginated_results('ec2', 'describe_vpn_connections', 'VpnConnections')
@@ -1,14 +1,97 @@
 from aws_quota.exceptions import InstanceWithIdentifierNotFound
+from aws_quota.inventory import inventory
+from aws_quota.transport import error_code, fan_out
+from aws_quota.utils import paginate
+import collections
 import typing
 import boto3
 from .quota_check import QuotaCheck, InstanceQuotaCheck, QuotaScope
 
+# largest page size accepted by the ELB and ELBv2 describe operations
+ELB_PAGE_SIZE = 400
+
+
+@inventory.cached('elb:classic-load-balancers')
+def get_all_clbs(session: boto3.Session) -> typing.List[dict]:
+    return list(paginate(session, 'elb', 'describe_load_balancers', 'LoadBalancerDescriptions', page_size=ELB_PAGE_SIZE))
+
+
+@inventory.cached('elb:classic-load-balancers-by-name')
+def get_clbs_by_name(session: boto3.Session) -> typing.Dict[str, dict]:
+    return {lb['LoadBalancerName']: lb for lb in get_all_clbs(session)}
+
+
+@inventory.cached('elbv2:load-balancers')
+def get_all_elbv2_load_balancers(session: boto3.Session) -> typing.List[dict]:
+    return list(paginate(session, 'elbv2', 'describe_load_balancers', 'LoadBalancers', page_size=ELB_PAGE_SIZE))
+
+
+@inventory.cached('elbv2:load-balancers-by-arn')
+def get_elbv2_load_balancers_by_arn(session: boto3.Session) -> typing.Dict[str, dict]:
+    return {lb['LoadBalancerArn']: lb for lb in get_all_elbv2_load_balancers(session)}
+
+
+@inventory.cached('elbv2:target-groups')
+def get_all_target_groups(session: boto3.Session) -> typing.List[dict]:
+    return list(paginate(session, 'elbv2', 'describe_target_groups', 'TargetGroups', page_size=ELB_PAGE_SIZE))
+
+
+@inventory.cached('elbv2:target-group-counts')
+def get_target_group_counts(session: boto3.Session) -> typing.Dict[str, int]:
+    """Returns the number of target groups per load balancer ARN"""
+    counts = collections.Counter()
+
+    for target_group in get_all_target_groups(session):
+        counts.update(target_group['LoadBalancerArns'])
+
+    return dict(counts)
+
+
+@inventory.cached('elbv2:listener-counts')
+def get_listener_counts(session: boto3.Session) -> typing.Tuple[typing.Dict[str, int], typing.Dict[str, Exception]]:
+    """Counts the listeners of all application and network load balancers
+
+    Listeners can only be described per load balancer, they are counted by a bounded
+    parallel sweep. Returns the counts and errors per ARN, load balancers deleted since
+    they were listed are part of neither.
+    """
+    listeners, errors = fan_out(
+        session, 'elbv2', 'describe_listeners',
+        {lb['LoadBalancerArn']: {'LoadBalancerArn': lb['LoadBalancerArn']}
+         for lb in get_all_elbv2_load_balancers(session) if lb['Type'] in ('application', 'network')},
+        key='Listeners',
+        page_size=ELB_PAGE_SIZE
+    )
+
+    return ({arn: len(arn_listeners) for arn, arn_listeners in listeners.items()},
+            {arn: e for arn, e in errors.items() if error_code(e) != 'LoadBalancerNotFound'})
+
+
+def get_elbv2_load_balancer_count(check: InstanceQuotaCheck, counts: typing.Dict[str, int]) -> int:
+    """Looks up the count of the check's load balancer, load balancers without an entry have none"""
+    if check.instance_id not in get_elbv2_load_balancers_by_arn(check.boto_session):
+        raise InstanceWithIdentifierNotFound(check)
+
+    return counts.get(check.instance_id, 0)
+
+
+def get_elbv2_listener_count(check: InstanceQuotaCheck) -> int:
+    counts, errors = get_listener_counts(check.boto_session)
+
+    if check.instance_id in errors:
+        raise errors[check.instance_id]
+
+    if check.instance_id not in counts:
+        raise InstanceWithIdentifierNotFound(check)
+
+    return counts[check.instance_id]
+
 
 def get_albs(session: boto3.Session):
     return list(
         filter(
             lambda lb: lb['Type'] == 'application',
-            session.client('elbv2').describe_load_balancers()['LoadBalancers'],
+            get_all_elbv2_load_balancers(session),
         )
     )
 
@@ -17,7 +100,7 @@ def get_nlbs(session: boto3.Session):
     return list(
         filter(
             lambda lb: lb['Type'] == 'network',
-            session.client('elbv2').describe_load_balancers()['LoadBalancers'],
+            get_all_elbv2_load_balancers(session),
         )
     )
 
@@ -31,9 +114,7 @@ class ClassicLoadBalancerCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(
-            self.boto_session.client('elb').describe_load_balancers()['LoadBalancerDescriptions']
-        )
+        return len(get_all_clbs(self.boto_session))
 
 
 class ListenerPerClassicLoadBalancerCountCheck(InstanceQuotaCheck):
@@ -45,21 +126,17 @@ class ListenerPerClassicLoadBalancerCountCheck(InstanceQuotaCheck):
 
     @staticmethod
     def get_all_identifiers(session: boto3.Session) -> typing.List[str]:
-        return [
-            lb['LoadBalancerName']
-            for lb in session.client('elb').describe_load_balancers()['LoadBalancerDescriptions']
-        ]
+        return [lb['LoadBalancerName'] for lb in get_all_clbs(session)]
 
     @property
     def current(self):
-        try:
-            return len(
-                self.boto_session.client('elb').describe_load_balancers(
-                    LoadBalancerNames=[self.instance_id]
-                )['LoadBalancerDescriptions'][0]['ListenerDescriptions']
-            )
-        except self.boto_session.client('elb').exceptions.AccessPointNotFoundException as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        # the descriptions of the listing already contain the listeners
+        clbs = get_clbs_by_name(self.boto_session)
+
+        if self.instance_id not in clbs:
+            raise InstanceWithIdentifierNotFound(self)
+
+        return len(clbs[self.instance_id]['ListenerDescriptions'])
 
 
 class NetworkLoadBalancerCountCheck(QuotaCheck):
@@ -71,14 +148,7 @@ class NetworkLoadBalancerCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(
-            list(
-                filter(
-                    lambda lb: lb['Type'] == 'network',
-                    self.boto_session.client('elbv2').describe_load_balancers()['LoadBalancers'],
-                )
-            )
-        )
+        return len(get_nlbs(self.boto_session))
 
 
 class ListenerPerNetworkLoadBalancerCountCheck(InstanceQuotaCheck):
@@ -94,14 +164,7 @@ class ListenerPerNetworkLoadBalancerCountCheck(InstanceQuotaCheck):
 
     @property
     def current(self):
-        try:
-            return len(
-                self.boto_session.client('elbv2').describe_listeners(
-                    LoadBalancerArn=self.instance_id
-                )['Listeners']
-            )
-        except self.boto_session.client('elbv2').exceptions.LoadBalancerNotFoundException as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        return get_elbv2_listener_count(self)
 
 
 class ApplicationLoadBalancerCountCheck(QuotaCheck):
@@ -129,14 +192,7 @@ class ListenerPerApplicationLoadBalancerCountCheck(InstanceQuotaCheck):
 
     @property
     def current(self) -> int:
-        try:
-            return len(
-                self.boto_session.client('elbv2').describe_listeners(
-                    LoadBalancerArn=self.instance_id
-                )['Listeners']
-            )
-        except self.boto_session.client('elbv2').exceptions.LoadBalancerNotFoundException as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        return get_elbv2_listener_count(self)
 
 
 class TargetGroupCountCheck(QuotaCheck):
@@ -148,7 +204,7 @@ class TargetGroupCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(self.boto_session.client('elbv2').describe_target_groups()['TargetGroups'])
+        return len(get_all_target_groups(self.boto_session))
 
 
 class TargetGroupsPerApplicationLoadBalancerCountCheck(InstanceQuotaCheck):
@@ -164,11 +220,4 @@ class TargetGroupsPerApplicationLoadBalancerCountCheck(InstanceQuotaCheck):
 
     @property
     def current(self) -> int:
-        try:
-            return len(
-                self.boto_session.client('elbv2').describe_target_groups(
-                    LoadBalancerArn=self.instance_id
-                )['TargetGroups']
-            )
-        except self.boto_session.client('elbv2').exceptions.LoadBalancerNotFoundException as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        return get_elbv2_load_balancer_count(self, get_target_group_counts(self.boto_session))
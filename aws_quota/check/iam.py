@@ -1,10 +1,33 @@
 from aws_quota.exceptions import InstanceWithIdentifierNotFound
+from aws_quota.inventory import inventory
+from aws_quota.utils import get_client, iter_pages
 import typing
 
 import boto3
 from .quota_check import InstanceQuotaCheck, QuotaCheck, QuotaScope
 
 
+@inventory.cached('iam:account-summary')
+def get_account_summary(session: boto3.Session) -> typing.Dict[str, int]:
+    return get_client(session, 'iam').get_account_summary()['SummaryMap']
+
+
+@inventory.cached('iam:attached-policy-counts')
+def get_attached_policy_counts(session: boto3.Session) -> typing.Dict[str, typing.Dict[str, int]]:
+    """Returns the number of attached managed policies per user, group and role name
+
+    A single paginated get_account_authorization_details sweep covers all principals.
+    """
+    counts = {'User': {}, 'Group': {}, 'Role': {}}
+
+    for page in iter_pages(session, 'iam', 'get_account_authorization_details', page_size=1000, Filter=list(counts)):
+        for entity, principals in counts.items():
+            for principal in page.get(f'{entity}DetailList', []):
+                principals[principal[f'{entity}Name']] = len(principal.get('AttachedManagedPolicies', []))
+
+    return counts
+
+
 class GroupCountCheck(QuotaCheck):
     key = "iam_group_count"
     description = "IAM groups per Account"
@@ -12,11 +35,11 @@ class GroupCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['GroupsQuota']
+        return get_account_summary(self.boto_session)['GroupsQuota']
 
     @property
     def current(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['Groups']
+        return get_account_summary(self.boto_session)['Groups']
 
 
 class UsersCountCheck(QuotaCheck):
@@ -26,11 +49,11 @@ class UsersCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['UsersQuota']
+        return get_account_summary(self.boto_session)['UsersQuota']
 
     @property
     def current(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['Users']
+        return get_account_summary(self.boto_session)['Users']
 
 
 class PolicyCountCheck(QuotaCheck):
@@ -40,11 +63,11 @@ class PolicyCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['PoliciesQuota']
+        return get_account_summary(self.boto_session)['PoliciesQuota']
 
     @property
     def current(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['Policies']
+        return get_account_summary(self.boto_session)['Policies']
 
 
 class PolicyVersionCountCheck(QuotaCheck):
@@ -54,11 +77,11 @@ class PolicyVersionCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['PolicyVersionsInUseQuota']
+        return get_account_summary(self.boto_session)['PolicyVersionsInUseQuota']
 
     @property
     def current(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['PolicyVersionsInUse']
+        return get_account_summary(self.boto_session)['PolicyVersionsInUse']
 
 
 class ServerCertificateCountCheck(QuotaCheck):
@@ -68,11 +91,11 @@ class ServerCertificateCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['ServerCertificatesQuota']
+        return get_account_summary(self.boto_session)['ServerCertificatesQuota']
 
     @property
     def current(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['ServerCertificates']
+        return get_account_summary(self.boto_session)['ServerCertificates']
 
 
 class AttachedPolicyPerUserCheck(InstanceQuotaCheck):
@@ -82,18 +105,20 @@ class AttachedPolicyPerUserCheck(InstanceQuotaCheck):
 
     @staticmethod
     def get_all_identifiers(session: boto3.Session) -> typing.List[str]:
-        return [user['UserName'] for user in session.client('iam').list_users()['Users']]
+        return list(get_attached_policy_counts(session)['User'])
 
     @property
     def maximum(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['AttachedPoliciesPerUserQuota']
+        return get_account_summary(self.boto_session)['AttachedPoliciesPerUserQuota']
 
     @property
     def current(self):
-        try:
-            return len(self.boto_session.client('iam').list_user_policies(UserName=self.instance_id)['PolicyNames'])
-        except self.boto_session.client('iam').exceptions.NoSuchEntityException as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        counts = get_attached_policy_counts(self.boto_session)['User']
+
+        if self.instance_id not in counts:
+            raise InstanceWithIdentifierNotFound(self)
+
+        return counts[self.instance_id]
 
 class AttachedPolicyPerGroupCheck(InstanceQuotaCheck):
     key = "iam_attached_policy_per_group"
@@ -102,18 +127,20 @@ class AttachedPolicyPerGroupCheck(InstanceQuotaCheck):
 
     @staticmethod
     def get_all_identifiers(session: boto3.Session) -> typing.List[str]:
-        return [user['GroupName'] for user in session.client('iam').list_groups()['Groups']]
+        return list(get_attached_policy_counts(session)['Group'])
 
     @property
     def maximum(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['AttachedPoliciesPerGroupQuota']
+        return get_account_summary(self.boto_session)['AttachedPoliciesPerGroupQuota']
 
     @property
     def current(self):
-        try:
-            return len(self.boto_session.client('iam').list_group_policies(GroupName=self.instance_id)['PolicyNames'])
-        except self.boto_session.client('iam').exceptions.NoSuchEntityException as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        counts = get_attached_policy_counts(self.boto_session)['Group']
+
+        if self.instance_id not in counts:
+            raise InstanceWithIdentifierNotFound(self)
+
+        return counts[self.instance_id]
 
 class AttachedPolicyPerRoleCheck(InstanceQuotaCheck):
     key = "iam_attached_policy_per_role"
@@ -122,15 +149,17 @@ class AttachedPolicyPerRoleCheck(InstanceQuotaCheck):
 
     @staticmethod
     def get_all_identifiers(session: boto3.Session) -> typing.List[str]:
-        return [user['RoleName'] for user in session.client('iam').list_roles()['Roles']]
+        return list(get_attached_policy_counts(session)['Role'])
 
     @property
     def maximum(self):
-        return self.boto_session.client('iam').get_account_summary()['SummaryMap']['AttachedPoliciesPerRoleQuota']
+        return get_account_summary(self.boto_session)['AttachedPoliciesPerRoleQuota']
 
     @property
     def current(self):
-        try:
-            return len(self.boto_session.client('iam').list_role_policies(RoleName=self.instance_id)['PolicyNames'])
-        except self.boto_session.client('iam').exceptions.NoSuchEntityException as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        counts = get_attached_policy_counts(self.boto_session)['Role']
+
+        if self.instance_id not in counts:
+            raise InstanceWithIdentifierNotFound(self)
+
+        return counts[self.instance_id]
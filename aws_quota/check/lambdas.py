@@ -1,3 +1,4 @@
+from aws_quota.utils import get_client
 from .quota_check import QuotaCheck, QuotaScope
 
 
@@ -11,7 +12,7 @@ class FunctionAndLayerStorageCheck(QuotaCheck):
     @property
     def current(self):
         return (
-            self.boto_session.client('lambda').get_account_settings()['AccountUsage'][
+            get_client(self.boto_session, 'lambda').get_account_settings()['AccountUsage'][
                 'TotalCodeSize'
             ]
             / 1000000000
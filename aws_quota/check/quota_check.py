@@ -1,8 +1,12 @@
-from aws_quota.utils import get_account_id
+from aws_quota.limit_store import get_limit_store
+from aws_quota.utils import count_paginated, get_account_id, get_client, paginate
 import enum
+import threading
 import typing
+import weakref
 
 import boto3
+import cachetools
 
 
 class QuotaScope(enum.Enum):
@@ -11,6 +15,128 @@ class QuotaScope(enum.Enum):
     INSTANCE = 2
 
 
+SERVICE_QUOTAS_TTL = 600
+# lower bound of the number of cached quota listings and lookups, no matter how few sessions are checked
+MIN_SERVICE_QUOTAS_CACHE_SIZE = 4096
+
+_service_quotas_cache = cachetools.TTLCache(maxsize=MIN_SERVICE_QUOTAS_CACHE_SIZE, ttl=SERVICE_QUOTAS_TTL)
+_service_quotas_lock = threading.Lock()
+# fetch locks per session and service code, dropped along with their session
+_service_quotas_fetch_locks = weakref.WeakKeyDictionary()
+
+
+def _fetch_once(session: boto3.Session, key: tuple, fetch: typing.Callable):
+    """Returns the cached result of fetch for session and key, concurrent misses only call fetch once"""
+    cache_key = cachetools.keys.hashkey(session, *key)
+
+    with _service_quotas_lock:
+        if cache_key in _service_quotas_cache:
+            return _service_quotas_cache[cache_key]
+
+        fetch_lock = _service_quotas_fetch_locks.setdefault(session, {}).setdefault(key, threading.Lock())
+
+    with fetch_lock:
+        with _service_quotas_lock:
+            if cache_key in _service_quotas_cache:
+                return _service_quotas_cache[cache_key]
+
+        result = fetch()
+
+        with _service_quotas_lock:
+            _service_quotas_cache[cache_key] = result
+
+    return result
+
+
+def get_service_quotas(session: boto3.Session, service_code: str) -> typing.Dict[str, float]:
+    """Returns all quota values of a service indexed by quota code
+
+    AWS default values are overridden by the applied values of the account. The values
+    are also written to the limit store, if one is configured. Concurrent lookups of the
+    same service only fetch the values once.
+    """
+    return _fetch_once(session, (service_code,), lambda: fetch_service_quotas(session, service_code))
+
+
+def get_service_quota(session: boto3.Session, service_code: str, quota_code: str) -> float:
+    """Returns a quota value that is missing from the listing of its service
+
+    The value is looked up on its own, first the applied and then the AWS default value.
+    Lookups are cached like the listing, including quotas that AWS doesn't know, so that
+    instance checks of such a quota don't send the same requests again.
+    """
+    def fetch():
+        client = get_client(session, 'service-quotas')
+
+        try:
+            return client.get_service_quota(ServiceCode=service_code, QuotaCode=quota_code)['Quota']['Value']
+        except client.exceptions.NoSuchResourceException:
+            pass
+
+        try:
+            return client.get_aws_default_service_quota(ServiceCode=service_code, QuotaCode=quota_code)['Quota']['Value']
+        except client.exceptions.NoSuchResourceException as e:
+            return e
+
+    result = _fetch_once(session, (service_code, quota_code), fetch)
+
+    if isinstance(result, Exception):
+        # a new exception each time, raising the cached one would grow its traceback
+        raise type(result)(result.response, result.operation_name)
+
+    return result
+
+
+def fetch_service_quotas(session: boto3.Session, service_code: str) -> typing.Dict[str, float]:
+    quotas = {}
+
+    for method in ['list_aws_default_service_quotas', 'list_service_quotas']:
+        for quota in paginate(session, 'service-quotas', method, 'Quotas', ServiceCode=service_code):
+            quotas[quota['QuotaCode']] = quota['Value']
+
+    store = get_limit_store()
+
+    if store is not None:
+        store.put_many(get_account_id(session), session.region_name, service_code, quotas)
+
+    return quotas
+
+
+def configure_service_quotas(sessions: int = 1):
+    """Sizes the cache of quota values to hold every listing and lookup of the checks for sessions
+
+    Cached values are dropped.
+    """
+    global _service_quotas_cache
+
+    checks, pending = set(), [QuotaCheck]
+
+    while pending:
+        subclasses = set(pending.pop().__subclasses__()).difference(checks)
+        checks.update(subclasses)
+        pending.extend(subclasses)
+
+    # one listing per service code and one lookup per quota that is missing from it
+    per_session = len({check.service_code for check in checks if check.quota_code is not None}) + \
+        len({(check.service_code, check.quota_code) for check in checks if check.quota_code is not None})
+
+    with _service_quotas_lock:
+        _service_quotas_cache = cachetools.TTLCache(maxsize=max(MIN_SERVICE_QUOTAS_CACHE_SIZE, sessions * per_session),
+                                                    ttl=SERVICE_QUOTAS_TTL)
+
+
+def refresh_service_quotas(session: boto3.Session = None):
+    """Drops cached quota values of session, or all if it's not set, so that the next lookup fetches them again"""
+    with _service_quotas_lock:
+        if session is None:
+            _service_quotas_cache.clear()
+            return
+
+        for key in list(_service_quotas_cache.keys()):
+            if key[0] is session:
+                del _service_quotas_cache[key]
+
+
 class QuotaCheck:
     key: str = None
     description: str = None
@@ -22,15 +148,20 @@ class QuotaCheck:
         super().__init__()
 
         self.boto_session = boto_session
-        self.sq_client = boto_session.client('service-quotas')
+
+    @property
+    def sq_client(self):
+        return get_client(self.boto_session, 'service-quotas')
+
+    @property
+    def service(self) -> str:
+        return self.service_code or self.key.split('_')[0]
 
     def __str__(self) -> str:
         return f'{self.key}{self.label_values}'
 
-    def count_paginated_results(self, service: str, method: str, key: str, paginate_args: dict = {}) -> int:
-        paginator = self.boto_session.client(service).get_paginator(method)
-        page_iterable = paginator.paginate(**paginate_args)
-        return sum(len(page[key]) for page in page_iterable)
+    def count_paginated_results(self, service: str, method: str, key: str, paginate_args: dict = {}, page_size: int = None) -> int:
+        return count_paginated(self.boto_session, service, method, key, page_size, **paginate_args)
 
     @property
     def label_values(self):
@@ -45,12 +176,29 @@ class QuotaCheck:
                 'instance': self.instance_id
             }
 
+    def fetch_maximum(self) -> float:
+        quotas = get_service_quotas(self.boto_session, self.service_code)
+
+        if self.quota_code in quotas:
+            return quotas[self.quota_code]
+
+        return get_service_quota(self.boto_session, self.service_code, self.quota_code)
+
     @property
     def maximum(self) -> int:
-        try:
-            return int(self.sq_client.get_service_quota(ServiceCode=self.service_code, QuotaCode=self.quota_code)['Quota']['Value'])
-        except self.sq_client.exceptions.NoSuchResourceException:
-            return int(self.sq_client.get_aws_default_service_quota(ServiceCode=self.service_code, QuotaCode=self.quota_code)['Quota']['Value'])
+        store = get_limit_store()
+
+        if store is None:
+            return int(self.fetch_maximum())
+
+        key = (get_account_id(self.boto_session), self.boto_session.region_name, self.service_code, self.quota_code)
+        value = store.get(*key)
+
+        if value is None:
+            value = self.fetch_maximum()
+            store.put(*key, value)
+
+        return int(value)
 
     @property
     def current(self) -> int:
@@ -1,8 +1,188 @@
-from aws_quota.exceptions import InstanceWithIdentifierNotFound
+from aws_quota.exceptions import InstanceWithIdentifierNotFound, ValuePending
+from aws_quota.inventory import inventory
+from aws_quota.rate_limit import TokenBucket
+from aws_quota.utils import get_account_id, get_client, paginate
+import concurrent.futures
+import copy
+import itertools
+import queue
+import threading
+import time
 import typing
 import boto3
+import botocore.exceptions
 from .quota_check import InstanceQuotaCheck, QuotaCheck, QuotaScope
 
+# share of Route53's account wide budget of 5 requests per second used for limit lookups,
+# the rest is left for other Route53 clients
+LIMIT_LOOKUP_RATE = 3.0
+# results older than this are looked up again in the background
+LIMIT_LOOKUP_INTERVAL = 300
+# outdated results are still served for this long, longer than the limits check interval
+LIMIT_LOOKUP_TTL = 3600
+# failed lookups are reported for this long before they're retried
+LIMIT_LOOKUP_ERROR_TTL = 60
+# hosted zone limits only change on request, lookups that are just done for the limit are reused for longer
+ZONE_LIMIT_TTL = 86400
+
+# missing results are looked up before outdated ones
+MISSING_PRIORITY = 0
+OUTDATED_PRIORITY = 1
+
+
+def _copy_error(error: Exception) -> Exception:
+    """Returns a new exception like error, so that threads raising a cached error don't share its traceback"""
+    if isinstance(error, botocore.exceptions.ClientError):
+        return type(error)(error.response, error.operation_name)
+
+    return copy.copy(error)
+
+
+class LimitFetcher:
+    """Looks up Route53 account and hosted zone limits in the background
+
+    One lookup returns both the current count and the limit. Checks only read the cached
+    results, lookups are sent by one thread per account that paces them to
+    LIMIT_LOOKUP_RATE, so that neither the threads evaluating checks nor other Route53
+    clients are starved. Results are looked up again once they're older than the
+    interval and thereby spread over the refresh window like the reads of the checks.
+    """
+
+    def __init__(self,
+                 interval: float = LIMIT_LOOKUP_INTERVAL,
+                 ttl: float = LIMIT_LOOKUP_TTL,
+                 rate: float = LIMIT_LOOKUP_RATE) -> None:
+        self.interval = interval
+        self.ttl = ttl
+        self.rate = rate
+        self.fetches = 0
+        self.hits = 0
+        self._entries = {}
+        self._pending = {}
+        self._queues = {}
+        self._buckets = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def __bucket(self, account_id: str) -> TokenBucket:
+        with self._lock:
+            return self._buckets.setdefault(account_id, TokenBucket(self.rate, self.rate))
+
+    def __enqueue(self, session: boto3.Session, key, priority: int) -> concurrent.futures.Future:
+        """Queues a lookup of key unless it's pending already, has to be called with the lock held"""
+        if key in self._pending:
+            return self._pending[key]
+
+        account_id = key[0]
+        future = self._pending[key] = concurrent.futures.Future()
+
+        if account_id not in self._queues:
+            self._queues[account_id] = queue.PriorityQueue()
+            threading.Thread(target=self.__prefetch, args=(account_id, self._queues[account_id]),
+                             name=f'route53-limits-{account_id}', daemon=True).start()
+
+        self._queues[account_id].put((priority, next(self._sequence), key, session))
+
+        return future
+
+    def __prefetch(self, account_id: str, lookups: queue.PriorityQueue):
+        while True:
+            _, _, key, session = lookups.get()
+            _, limit_type, hosted_zone_id = key
+            result, error = None, None
+            self.__bucket(account_id).acquire()
+
+            try:
+                client = get_client(session, 'route53')
+
+                if hosted_zone_id is None:
+                    response = client.get_account_limit(Type=limit_type)
+                else:
+                    response = client.get_hosted_zone_limit(Type=limit_type, HostedZoneId=hosted_zone_id)
+
+                result = (response['Count'], response['Limit']['Value'])
+            except Exception as e:
+                error = e
+
+            with self._lock:
+                self.fetches += 1
+                self._entries[key] = (time.monotonic(), result, error)
+                future = self._pending.pop(key)
+
+                # drop expired entries, e.g. of deleted hosted zones, once in a while
+                if self.fetches % 1000 == 0:
+                    now = time.monotonic()
+                    self._entries = {k: e for k, e in self._entries.items() if now - e[0] <= ZONE_LIMIT_TTL + self.ttl}
+
+            # waiters read the result or error from the cache, so that none of them shares the exception
+            future.set_result(None)
+
+    def get(self,
+            session: boto3.Session,
+            limit_type: str,
+            hosted_zone_id: str = None,
+            max_age: float = None) -> typing.Tuple[int, int]:
+        """Returns the cached count and limit of limit_type, of the account or the given hosted zone
+
+        Results older than max_age seconds, interval by default, are looked up again in the
+        background and served for another ttl seconds meanwhile. If there's no result yet,
+        it's looked up and ValuePending is raised.
+        """
+        key = (get_account_id(session), limit_type, hosted_zone_id)
+        max_age = max_age if max_age is not None else self.interval
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                fetched_at, result, error = entry
+                age = time.monotonic() - fetched_at
+
+                if error is not None and age <= LIMIT_LOOKUP_ERROR_TTL:
+                    self.hits += 1
+                    raise _copy_error(error)
+
+                if error is None and age <= max_age + self.ttl:
+                    self.hits += 1
+
+                    if age > max_age:
+                        self.__enqueue(session, key, OUTDATED_PRIORITY)
+
+                    return result
+
+            future = self.__enqueue(session, key, MISSING_PRIORITY)
+
+        raise ValuePending(future)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'fetches': self.fetches,
+                'hits': self.hits,
+                'in_flight': len(self._pending)
+            }
+
+
+limit_fetcher = LimitFetcher()
+
+
+@inventory.cached('route53:hosted-zones')
+def get_hosted_zones_by_id(session: boto3.Session) -> typing.Dict[str, dict]:
+    return {zone['Id']: zone for zone in paginate(session, 'route53', 'list_hosted_zones', 'HostedZones', page_size=100)}
+
+
+def get_hosted_zone_limit(check: InstanceQuotaCheck, limit_type: str, max_age: float = None) -> typing.Tuple[int, int]:
+    try:
+        return limit_fetcher.get(check.boto_session, limit_type, check.instance_id, max_age)
+    except get_client(check.boto_session, 'route53').exceptions.NoSuchHostedZone as e:
+        raise InstanceWithIdentifierNotFound(check) from e
+
 
 class HostedZoneCountCheck(QuotaCheck):
     key = "route53_hosted_zone_count"
@@ -11,11 +191,11 @@ class HostedZoneCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_HOSTED_ZONES_BY_OWNER')['Limit']['Value']
+        return limit_fetcher.get(self.boto_session, 'MAX_HOSTED_ZONES_BY_OWNER')[1]
 
     @property
     def current(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_HOSTED_ZONES_BY_OWNER')['Count']
+        return limit_fetcher.get(self.boto_session, 'MAX_HOSTED_ZONES_BY_OWNER')[0]
 
 
 class HealthCheckCountCheck(QuotaCheck):
@@ -25,11 +205,11 @@ class HealthCheckCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_HEALTH_CHECKS_BY_OWNER')['Limit']['Value']
+        return limit_fetcher.get(self.boto_session, 'MAX_HEALTH_CHECKS_BY_OWNER')[1]
 
     @property
     def current(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_HEALTH_CHECKS_BY_OWNER')['Count']
+        return limit_fetcher.get(self.boto_session, 'MAX_HEALTH_CHECKS_BY_OWNER')[0]
 
 
 class ReusableDelegationSetCountCheck(QuotaCheck):
@@ -39,11 +219,11 @@ class ReusableDelegationSetCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_REUSABLE_DELEGATION_SETS_BY_OWNER')['Limit']['Value']
+        return limit_fetcher.get(self.boto_session, 'MAX_REUSABLE_DELEGATION_SETS_BY_OWNER')[1]
 
     @property
     def current(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_REUSABLE_DELEGATION_SETS_BY_OWNER')['Count']
+        return limit_fetcher.get(self.boto_session, 'MAX_REUSABLE_DELEGATION_SETS_BY_OWNER')[0]
 
 
 class TrafficPolicyCountCheck(QuotaCheck):
@@ -53,11 +233,11 @@ class TrafficPolicyCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_TRAFFIC_POLICIES_BY_OWNER')['Limit']['Value']
+        return limit_fetcher.get(self.boto_session, 'MAX_TRAFFIC_POLICIES_BY_OWNER')[1]
 
     @property
     def current(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_TRAFFIC_POLICIES_BY_OWNER')['Count']
+        return limit_fetcher.get(self.boto_session, 'MAX_TRAFFIC_POLICIES_BY_OWNER')[0]
 
 
 class TrafficPolicyInstanceCountCheck(QuotaCheck):
@@ -67,11 +247,11 @@ class TrafficPolicyInstanceCountCheck(QuotaCheck):
 
     @property
     def maximum(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_TRAFFIC_POLICY_INSTANCES_BY_OWNER')['Limit']['Value']
+        return limit_fetcher.get(self.boto_session, 'MAX_TRAFFIC_POLICY_INSTANCES_BY_OWNER')[1]
 
     @property
     def current(self):
-        return self.boto_session.client('route53').get_account_limit(Type='MAX_TRAFFIC_POLICY_INSTANCES_BY_OWNER')['Count']
+        return limit_fetcher.get(self.boto_session, 'MAX_TRAFFIC_POLICY_INSTANCES_BY_OWNER')[0]
 
 
 class RecordsPerHostedZoneCheck(InstanceQuotaCheck):
@@ -81,21 +261,21 @@ class RecordsPerHostedZoneCheck(InstanceQuotaCheck):
 
     @staticmethod
     def get_all_identifiers(session: boto3.Session) -> typing.List[str]:
-        return [zone['Id'] for zone in session.client('route53').list_hosted_zones()['HostedZones']]
+        return list(get_hosted_zones_by_id(session))
 
     @property
     def maximum(self):
-        try:
-            return self.boto_session.client('route53').get_hosted_zone_limit(Type='MAX_RRSETS_BY_ZONE', HostedZoneId=self.instance_id)['Limit']['Value']
-        except self.boto_session.client('route53').exceptions.NoSuchHostedZone as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        return get_hosted_zone_limit(self, 'MAX_RRSETS_BY_ZONE', ZONE_LIMIT_TTL)[1]
 
     @property
     def current(self):
-        try:
-            return self.boto_session.client('route53').get_hosted_zone_limit(Type='MAX_RRSETS_BY_ZONE', HostedZoneId=self.instance_id)['Count']
-        except self.boto_session.client('route53').exceptions.NoSuchHostedZone as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        # the zone listing already contains the number of records
+        zones = get_hosted_zones_by_id(self.boto_session)
+
+        if self.instance_id not in zones:
+            raise InstanceWithIdentifierNotFound(self)
+
+        return zones[self.instance_id]['ResourceRecordSetCount']
 
 
 class AssociatedVpcHostedZoneCheck(InstanceQuotaCheck):
@@ -105,18 +285,12 @@ class AssociatedVpcHostedZoneCheck(InstanceQuotaCheck):
 
     @staticmethod
     def get_all_identifiers(session: boto3.Session) -> typing.List[str]:
-        return [zone['Id'] for zone in session.client('route53').list_hosted_zones()['HostedZones'] if zone['Config']['PrivateZone']]
+        return [zone_id for zone_id, zone in get_hosted_zones_by_id(session).items() if zone['Config']['PrivateZone']]
 
     @property
     def maximum(self):
-        try:
-            return self.boto_session.client('route53').get_hosted_zone_limit(Type='MAX_VPCS_ASSOCIATED_BY_ZONE', HostedZoneId=self.instance_id)['Limit']['Value']
-        except self.boto_session.client('route53').exceptions.NoSuchHostedZone as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        return get_hosted_zone_limit(self, 'MAX_VPCS_ASSOCIATED_BY_ZONE')[1]
 
     @property
     def current(self):
-        try:
-            return self.boto_session.client('route53').get_hosted_zone_limit(Type='MAX_VPCS_ASSOCIATED_BY_ZONE', HostedZoneId=self.instance_id)['Count']
-        except self.boto_session.client('route53').exceptions.NoSuchHostedZone as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        return get_hosted_zone_limit(self, 'MAX_VPCS_ASSOCIATED_BY_ZONE')[0]
@@ -10,7 +10,7 @@ class EndpointCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(self.boto_session.client('route53resolver').list_resolver_endpoints()['ResolverEndpoints'])
+        return self.count_paginated_results('route53resolver', 'list_resolver_endpoints', 'ResolverEndpoints')
 
 class RulesCountCheck(QuotaCheck):
     key = "route53resolver_rule_count"
@@ -21,7 +21,7 @@ class RulesCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(self.boto_session.client('route53resolver').list_resolver_rules()['ResolverRules'])
+        return self.count_paginated_results('route53resolver', 'list_resolver_rules', 'ResolverRules')
 
 class RuleAssociationsCountCheck(QuotaCheck):
     key = "route53resolver_rule_association_count"
@@ -32,4 +32,4 @@ class RuleAssociationsCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(self.boto_session.client('route53resolver').list_resolver_rule_associations()['ResolverRuleAssociations'])
+        return self.count_paginated_results('route53resolver', 'list_resolver_rule_associations', 'ResolverRuleAssociations')
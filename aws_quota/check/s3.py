@@ -10,4 +10,4 @@ class BucketCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(self.boto_session.client('s3').list_buckets()['Buckets'])
+        return self.count_paginated_results('s3', 'list_buckets', 'Buckets')
@@ -1,3 +1,4 @@
+from aws_quota.utils import get_client
 import boto3
 from .quota_check import QuotaCheck, QuotaScope
 
@@ -11,4 +12,4 @@ class TopicCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return self.boto_session.client('ses').get_send_quota()['SentLast24Hours']
+        return get_client(self.boto_session, 'ses').get_send_quota()['SentLast24Hours']
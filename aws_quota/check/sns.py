@@ -1,37 +1,61 @@
 from aws_quota.exceptions import InstanceWithIdentifierNotFound
+from aws_quota.inventory import inventory
+from aws_quota.transport import error_code, fan_out
+from aws_quota.utils import paginate
+import logging
 import typing
 
 import boto3
 from .quota_check import QuotaCheck, InstanceQuotaCheck, QuotaScope
 
+logger = logging.getLogger(__name__)
+
+
+@inventory.cached('sns:topics')
+def get_all_topics(session: boto3.Session) -> typing.List[dict]:
+    return list(paginate(session, 'sns', 'list_topics', 'Topics'))
+
+
+@inventory.cached('sns:topic-attributes')
+def get_topic_attributes_by_arn(session: boto3.Session) -> typing.Tuple[typing.Dict[str, dict], typing.Dict[str, Exception]]:
+    """Returns the attributes of all topics and the errors of topics whose attributes couldn't be read
+
+    Topics that have been deleted since they were listed are part of neither.
+    """
+    responses, errors = fan_out(session, 'sns', 'get_topic_attributes',
+                                {topic['TopicArn']: {'TopicArn': topic['TopicArn']} for topic in get_all_topics(session)})
+
+    return ({arn: response['Attributes'] for arn, response in responses.items()},
+            {arn: e for arn, e in errors.items() if error_code(e) != 'NotFound'})
+
 
 class TopicCountCheck(QuotaCheck):
     key = "sns_topics_count"
     description = "SNS topics per account"
-    scope = QuotaScope.ACCOUNT
+    scope = QuotaScope.REGION
     service_code = 'sns'
     quota_code = 'L-61103206'
 
     @property
     def current(self):
-        return len(self.boto_session.client('sns').list_topics()['Topics'])
+        return len(get_all_topics(self.boto_session))
 
 class PendingSubscriptionCountCheck(QuotaCheck):
     key = "sns_pending_subscriptions_count"
     description = "Pending SNS subscriptions per account"
-    scope = QuotaScope.ACCOUNT
+    scope = QuotaScope.REGION
     service_code = 'sns'
     quota_code = 'L-1A43D3DB'
 
     @property
     def current(self):
-        all_topic_arns = SubscriptionsPerTopicCheck.get_all_identifiers(self.boto_session)
-        pending_subs = 0
+        attributes, errors = get_topic_attributes_by_arn(self.boto_session)
 
-        for arn in all_topic_arns:
-            pending_subs += int(self.boto_session.client('sns').get_topic_attributes(TopicArn=arn)['Attributes']['SubscriptionsPending'])
+        if errors:
+            logger.warning('pending subscriptions of %d topics are not counted, attributes could not be read: %s',
+                           len(errors), ', '.join(sorted(errors)))
 
-        return pending_subs
+        return sum(int(topic_attrs['SubscriptionsPending']) for topic_attrs in attributes.values())
 
 class SubscriptionsPerTopicCheck(InstanceQuotaCheck):
     key = "sns_subscriptions_per_topic"
@@ -42,13 +66,18 @@ class SubscriptionsPerTopicCheck(InstanceQuotaCheck):
 
     @staticmethod
     def get_all_identifiers(session: boto3.Session) -> typing.List[str]:
-        return [topic['TopicArn'] for topic in session.client('sns').list_topics()['Topics']]
+        return [topic['TopicArn'] for topic in get_all_topics(session)]
 
     @property
     def current(self):
-        try:
-            topic_attrs = self.boto_session.client('sns').get_topic_attributes(TopicArn=self.instance_id)['Attributes']
-        except self.boto_session.client('sns').exceptions.NotFoundException as e:
-            raise InstanceWithIdentifierNotFound(self) from e
+        attributes, errors = get_topic_attributes_by_arn(self.boto_session)
+
+        if self.instance_id in errors:
+            raise errors[self.instance_id]
+
+        if self.instance_id not in attributes:
+            raise InstanceWithIdentifierNotFound(self)
+
+        topic_attrs = attributes[self.instance_id]
 
         return int(topic_attrs['SubscriptionsConfirmed']) + int(topic_attrs['SubscriptionsPending'])
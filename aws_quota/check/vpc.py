@@ -1,61 +1,91 @@
-from cachetools import cache
 from aws_quota.exceptions import InstanceWithIdentifierNotFound
+from aws_quota.inventory import inventory
+from aws_quota.utils import paginate
+import collections
 import typing
 
 import boto3
-import botocore.exceptions
-import cachetools
 from .quota_check import QuotaCheck, InstanceQuotaCheck, QuotaScope
 
 
-def check_if_vpc_exists(session: boto3.Session, vpc_id: str) -> bool:
-    client = session.client('ec2')
-    try:
-        client.describe_vpcs(VpcIds=[vpc_id])
-    except botocore.exceptions.ClientError as e:
-        return False
-    return True
+def count_by_vpc(resources: typing.List[dict]) -> typing.Dict[str, int]:
+    return collections.Counter(resource['VpcId'] for resource in resources)
 
 
-@cachetools.cached(cache=cachetools.TTLCache(1, 60))
+@inventory.cached('ec2:vpcs')
 def get_all_vpcs(session: boto3.Session) -> typing.List[dict]:
-    return session.client('ec2').describe_vpcs()['Vpcs']
+    return list(paginate(session, 'ec2', 'describe_vpcs', 'Vpcs'))
+
+
+@inventory.cached('ec2:vpcs-by-id')
+def get_vpcs_by_id(session: boto3.Session) -> typing.Dict[str, dict]:
+    return {vpc['VpcId']: vpc for vpc in get_all_vpcs(session)}
 
 
 def get_vpc_by_id(session: boto3.Session, vpc_id: str) -> dict:
-    try:
-        return next(filter(lambda vpc: vpc_id == vpc['VpcId'], get_all_vpcs(session)))
-    except StopIteration:
-        raise KeyError
+    return get_vpcs_by_id(session)[vpc_id]
 
 
-@cachetools.cached(cache=cachetools.TTLCache(1, 60))
+@inventory.cached('ec2:security-groups')
 def get_all_sgs(session: boto3.Session) -> typing.List[dict]:
-    return session.client('ec2').describe_security_groups()['SecurityGroups']
+    return list(paginate(session, 'ec2', 'describe_security_groups', 'SecurityGroups'))
+
+
+@inventory.cached('ec2:security-groups-by-id')
+def get_sgs_by_id(session: boto3.Session) -> typing.Dict[str, dict]:
+    return {sg['GroupId']: sg for sg in get_all_sgs(session)}
 
 
 def get_sg_by_id(session: boto3.Session, sg_id: str) -> dict:
-    try:
-        return next(filter(lambda sg: sg_id == sg['GroupId'], get_all_sgs(session)))
-    except StopIteration:
-        raise KeyError
+    return get_sgs_by_id(session)[sg_id]
 
 
-@cachetools.cached(cache=cachetools.TTLCache(1, 60))
+@inventory.cached('ec2:route-tables')
 def get_all_rts(session: boto3.Session) -> typing.List[dict]:
-    return session.client('ec2').describe_route_tables()['RouteTables']
+    return list(paginate(session, 'ec2', 'describe_route_tables', 'RouteTables'))
+
+
+@inventory.cached('ec2:route-tables-by-id')
+def get_rts_by_id(session: boto3.Session) -> typing.Dict[str, dict]:
+    return {rt['RouteTableId']: rt for rt in get_all_rts(session)}
 
 
 def get_rt_by_id(session: boto3.Session, rt_id: str) -> dict:
-    try:
-        return next(filter(lambda rt: rt_id == rt['RouteTableId'], get_all_rts(session)))
-    except StopIteration:
-        raise KeyError
+    return get_rts_by_id(session)[rt_id]
+
+
+@inventory.cached('ec2:route-tables-per-vpc')
+def get_rt_count_by_vpc(session: boto3.Session) -> typing.Dict[str, int]:
+    return count_by_vpc(get_all_rts(session))
+
+
+@inventory.cached('ec2:subnets')
+def get_all_subnets(session: boto3.Session) -> typing.List[dict]:
+    return list(paginate(session, 'ec2', 'describe_subnets', 'Subnets'))
+
+
+@inventory.cached('ec2:subnets-per-vpc')
+def get_subnet_count_by_vpc(session: boto3.Session) -> typing.Dict[str, int]:
+    return count_by_vpc(get_all_subnets(session))
 
 
-@cachetools.cached(cache=cachetools.TTLCache(1, 60))
+@inventory.cached('ec2:network-acls')
 def get_all_network_acls(session: boto3.Session) -> typing.List[dict]:
-    return session.client('ec2').describe_network_acls()['NetworkAcls']
+    return list(paginate(session, 'ec2', 'describe_network_acls', 'NetworkAcls'))
+
+
+@inventory.cached('ec2:network-acls-by-id')
+def get_network_acls_by_id(session: boto3.Session) -> typing.Dict[str, dict]:
+    return {acl['NetworkAclId']: acl for acl in get_all_network_acls(session)}
+
+
+def get_network_acl_by_id(session: boto3.Session, acl_id: str) -> dict:
+    return get_network_acls_by_id(session)[acl_id]
+
+
+@inventory.cached('ec2:network-acls-per-vpc')
+def get_network_acl_count_by_vpc(session: boto3.Session) -> typing.Dict[str, int]:
+    return count_by_vpc(get_all_network_acls(session))
 
 
 class VpcCountCheck(QuotaCheck):
@@ -79,7 +109,7 @@ class InternetGatewayCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(self.boto_session.client('ec2').describe_internet_gateways()['InternetGateways'])
+        return self.count_paginated_results('ec2', 'describe_internet_gateways', 'InternetGateways')
 
 
 class NetworkInterfaceCountCheck(QuotaCheck):
@@ -91,7 +121,7 @@ class NetworkInterfaceCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(self.boto_session.client('ec2').describe_network_interfaces()['NetworkInterfaces'])
+        return self.count_paginated_results('ec2', 'describe_network_interfaces', 'NetworkInterfaces', page_size=1000)
 
 
 class SecurityGroupCountCheck(QuotaCheck):
@@ -103,7 +133,7 @@ class SecurityGroupCountCheck(QuotaCheck):
 
     @property
     def current(self):
-        return len(self.boto_session.client('ec2').describe_security_groups()['SecurityGroups'])
+        return len(get_all_sgs(self.boto_session))
 
 
 class RulesPerSecurityGroupCheck(InstanceQuotaCheck):
@@ -139,15 +169,11 @@ class RouteTablesPerVpcCheck(InstanceQuotaCheck):
 
     @property
     def current(self):
-        if check_if_vpc_exists(self.boto_session, self.instance_id):
-            return len(self.boto_session.client('ec2').describe_route_tables(Filters=[
-                {
-                    'Name': 'vpc-id',
-                    'Values': [self.instance_id]
-                }])['RouteTables'])
-        else:
+        if self.instance_id not in get_vpcs_by_id(self.boto_session):
             raise InstanceWithIdentifierNotFound(self)
 
+        return get_rt_count_by_vpc(self.boto_session).get(self.instance_id, 0)
+
 
 class RoutesPerRouteTableCheck(InstanceQuotaCheck):
     key = "vpc_routes_per_route_table"
@@ -182,15 +208,11 @@ class SubnetsPerVpcCheck(InstanceQuotaCheck):
 
     @property
     def current(self):
-        if check_if_vpc_exists(self.boto_session, self.instance_id):
-            return len(self.boto_session.client('ec2').describe_subnets(Filters=[
-                {
-                    'Name': 'vpc-id',
-                    'Values': [self.instance_id]
-                }])['Subnets'])
-        else:
+        if self.instance_id not in get_vpcs_by_id(self.boto_session):
             raise InstanceWithIdentifierNotFound(self)
 
+        return get_subnet_count_by_vpc(self.boto_session).get(self.instance_id, 0)
+
 
 class AclsPerVpcCheck(InstanceQuotaCheck):
     key = "vpc_acls_per_vpc"
@@ -205,15 +227,11 @@ class AclsPerVpcCheck(InstanceQuotaCheck):
 
     @property
     def current(self) -> int:
-        if check_if_vpc_exists(self.boto_session, self.instance_id):
-            return len(self.boto_session.client('ec2').describe_network_acls(Filters=[
-                {
-                    'Name': 'vpc-id',
-                    'Values': [self.instance_id]
-                }])['NetworkAcls'])
-        else:
+        if self.instance_id not in get_vpcs_by_id(self.boto_session):
             raise InstanceWithIdentifierNotFound(self)
 
+        return get_network_acl_count_by_vpc(self.boto_session).get(self.instance_id, 0)
+
 
 class RulesPerAclCheck(InstanceQuotaCheck):
     key = "vpc_rules_per_acl"
@@ -228,10 +246,9 @@ class RulesPerAclCheck(InstanceQuotaCheck):
 
     @property
     def current(self) -> int:
-        acls = get_all_network_acls(self.boto_session)
-        if self.instance_id in [acl['NetworkAclId'] for acl in acls]:
-            return len(next(filter(lambda acl: self.instance_id == acl['NetworkAclId'], acls))['Entries'])
-        else:
+        try:
+            return len(get_network_acl_by_id(self.boto_session, self.instance_id)['Entries'])
+        except KeyError:
             raise InstanceWithIdentifierNotFound(self)
 
 
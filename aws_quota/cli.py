@@ -1,14 +1,22 @@
 import logging
-from aws_quota.utils import get_account_id
+from aws_quota.inventory import configure_inventory
+from aws_quota.limit_store import DEFAULT_TTL, configure_limit_store
+from aws_quota.transport import BOTO3_TRANSPORT, TRANSPORTS, configure_transport
+from aws_quota.utils import SWEEP_CONCURRENCY, configure_clients, get_account_id
+import collections
+import concurrent.futures
 import enum
+import threading
 import typing
 import sys
 import boto3
 import click
 import tabulate
 
-from aws_quota.check.quota_check import InstanceQuotaCheck, QuotaCheck, QuotaScope
+from aws_quota.check.quota_check import InstanceQuotaCheck, QuotaCheck, QuotaScope, configure_service_quotas
 from aws_quota.check import ALL_CHECKS, ALL_INSTANCE_SCOPED_CHECKS
+from aws_quota.exceptions import ValuePending
+from aws_quota.sessions import create_sessions, get_check_classes_by_session
 
 CHECKMARK = u'\u2713'
 ALL_CHECKS_CHOICE = click.Choice(['all'] + [chk.key for chk in ALL_CHECKS])
@@ -35,23 +43,78 @@ def check_keys_to_check_classes(check_string: str):
         filter(lambda c: c.key not in blacklisted_check_keys, selected_checks))
 
 
+def collect_checks(session: boto3.Session, check_class: QuotaCheck) -> typing.List[QuotaCheck]:
+    if issubclass(check_class, InstanceQuotaCheck):
+        return [check_class(session, identifier) for identifier in check_class.get_all_identifiers(session)]
+    else:
+        return [check_class(session)]
+
+
 class Runner:
     class ReportResult(enum.Enum):
         SUCCESS = 0
         WARNING = 1
         ERROR = 2
 
-    def __init__(self, session: boto3.Session,
+    def __init__(self,
                  checks: typing.List[QuotaCheck],
                  warning_threshold: float,
                  error_threshold: float,
-                 fail_on_error: bool) -> None:
+                 fail_on_error: bool,
+                 concurrency: int = 1,
+                 service_concurrency: int = 4) -> None:
 
-        self.session = session
         self.checks = checks
         self.warning_threshold = warning_threshold
         self.error_threshold = error_threshold
         self.fail_on_warning = fail_on_error
+        self.concurrency = concurrency
+        self.service_concurrency = service_concurrency
+        # checks waiting for a free slot of their service and number of running checks per session and service
+        self.__pending = collections.defaultdict(collections.deque)
+        self.__running = collections.Counter()
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    def __submit(self, key: typing.Tuple[boto3.Session, str]):
+        """Starts pending checks of a service while it has free slots, has to be called with the lock held
+
+        Checks are only handed to the pool once their service has a free slot, so that no
+        worker waits for a slot while checks of other services are pending.
+        """
+        pending = self.__pending[key]
+
+        while pending and self.__running[key] < self.service_concurrency:
+            self.__running[key] += 1
+            self.__executor.submit(self.__evaluate, key, *pending.popleft())
+
+    def __requeue(self, key: typing.Tuple[boto3.Session, str], chk: QuotaCheck, result: concurrent.futures.Future):
+        with self.__lock:
+            self.__pending[key].appendleft((chk, result))
+            self.__submit(key)
+
+    def __evaluate(self, key: typing.Tuple[boto3.Session, str], chk: QuotaCheck, result: concurrent.futures.Future):
+        values, error, pending = None, None, None
+
+        try:
+            values = chk.current, chk.maximum
+        except ValuePending as e:
+            pending = e.future
+        except Exception as e:
+            error = e
+
+        # the slot is passed on before the result is reported, the report only ends once all checks are started
+        with self.__lock:
+            self.__running[key] -= 1
+            self.__submit(key)
+
+        if pending is not None:
+            # evaluated again once the value is available, neither a worker nor a slot of the service is held meanwhile
+            pending.add_done_callback(lambda _: self.__requeue(key, chk, result))
+        elif error is None:
+            result.set_result(values)
+        else:
+            result.set_exception(error)
 
     def __report(self, description, scope, current, maximum) -> ReportResult:
         if maximum != 0:
@@ -83,23 +146,35 @@ class Runner:
         errors = 0
         warnings = 0
 
-        for chk in self.checks:
-            current = chk.current
-            maximum = chk.maximum
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            self.__executor = executor
+            results = [concurrent.futures.Future() for _ in self.checks]
+
+            with self.__lock:
+                for chk, result in zip(self.checks, results):
+                    self.__pending[(chk.boto_session, chk.service)].append((chk, result))
 
-            if chk.scope == QuotaScope.ACCOUNT:
-                scope = get_account_id(self.session)
-            elif chk.scope == QuotaScope.REGION:
-                scope = f'{get_account_id(self.session)}/{self.session.region_name}'
-            elif chk.scope == QuotaScope.INSTANCE:
-                scope = f'{get_account_id(self.session)}/{self.session.region_name}/{chk.instance_id}'
+                for key in list(self.__pending):
+                    self.__submit(key)
 
-            result = self.__report(chk.description, scope, current, maximum)
+            # results are reported in the order of the checks, so the report is stable regardless of concurrency
+            for chk, result in zip(self.checks, results):
+                current, maximum = result.result()
+                session = chk.boto_session
 
-            if result == Runner.ReportResult.WARNING:
-                warnings += 1
-            elif result == Runner.ReportResult.ERROR:
-                errors += 1
+                if chk.scope == QuotaScope.ACCOUNT:
+                    scope = get_account_id(session)
+                elif chk.scope == QuotaScope.REGION:
+                    scope = f'{get_account_id(session)}/{session.region_name}'
+                elif chk.scope == QuotaScope.INSTANCE:
+                    scope = f'{get_account_id(session)}/{session.region_name}/{chk.instance_id}'
+
+                result = self.__report(chk.description, scope, current, maximum)
+
+                if result == Runner.ReportResult.WARNING:
+                    warnings += 1
+                elif result == Runner.ReportResult.ERROR:
+                    errors += 1
 
         if (self.fail_on_warning and warnings > 0) or errors > 0:
             sys.exit(1)
@@ -119,6 +194,44 @@ def common_scope_options(function):
     return function
 
 
+def regions_option(function):
+    return click.option(
+        '--regions', help='Comma separated list of regions to check in parallel or all-enabled for all regions enabled in the account, overrides --region')(function)
+
+
+def accounts_options(function):
+    function = click.option(
+        '--role-name', help='Name of the IAM role to assume in every account passed with --accounts')(function)
+    function = click.option(
+        '--accounts', help='Comma separated list of account IDs to check in parallel or organization for all active accounts of the AWS Organization, requires --role-name')(function)
+
+    return function
+
+
+def common_client_options(function):
+    function = click.option(
+        '--max-pool-connections', help='Maximum number of pooled connections per AWS client, defaults to 10', default=10)(function)
+    function = click.option('--tcp-keepalive/--no-tcp-keepalive',
+                            help='Enable TCP keep-alive for AWS API connections, defaults to true', default=True)(function)
+    function = click.option(
+        '--max-attempts', help='Maximum number of attempts per AWS API request, throttled requests are retried with adaptive backoff, defaults to 10', default=10)(function)
+    function = click.option('--transport', type=click.Choice(TRANSPORTS),
+                            help=f'Transport of requests sent per resource, e.g. per SNS topic, aiobotocore sends them from a single event loop thread if installed, defaults to {BOTO3_TRANSPORT}', default=BOTO3_TRANSPORT)(function)
+    function = click.option(
+        '--max-concurrent-requests', help=f'Maximum number of requests sent per resource in flight at once, defaults to {SWEEP_CONCURRENCY}', default=SWEEP_CONCURRENCY)(function)
+
+    return function
+
+
+def common_cache_options(function):
+    function = click.option(
+        '--cache-dir', help='Directory in which to persist quota limits between runs, disabled by default')(function)
+    function = click.option(
+        '--limits-cache-ttl', help=f'Time in seconds after which persisted quota limits are fetched again, defaults to {DEFAULT_TTL}', default=DEFAULT_TTL)(function)
+
+    return function
+
+
 def common_check_options(function):
     function = click.option(
         '--warning-threshold', help='Warning threshold percentage for quota utilization, defaults to 0.8', default=0.8)(function)
@@ -132,9 +245,15 @@ def common_check_options(function):
 
 @cli.command()
 @common_scope_options
+@regions_option
+@accounts_options
+@common_client_options
+@common_cache_options
 @common_check_options
+@click.option('--concurrency', help='Number of checks to evaluate in parallel, defaults to 1', default=1)
+@click.option('--service-concurrency', help='Maximum number of checks per AWS service to evaluate in parallel, defaults to 4', default=4)
 @click.argument('check-keys')
-def check(check_keys, region, profile, warning_threshold, error_threshold, fail_on_warning):
+def check(check_keys, region, regions, role_name, accounts, profile, max_pool_connections, tcp_keepalive, max_attempts, transport, max_concurrent_requests, cache_dir, limits_cache_ttl, warning_threshold, error_threshold, fail_on_warning, concurrency, service_concurrency):
     """Run checks identified by CHECK_KEYS
 
     e.g. check vpc_count,ecs_count
@@ -151,39 +270,50 @@ def check(check_keys, region, profile, warning_threshold, error_threshold, fail_
 
     selected_checks = check_keys_to_check_classes(check_keys)
 
-    session = boto3.Session(region_name=region, profile_name=profile)
+    if bool(role_name) != bool(accounts):
+        raise click.UsageError('--role-name and --accounts have to be passed together')
+
+    configure_clients(max_pool_connections, tcp_keepalive, max_attempts)
+    configure_transport(transport, max_concurrent_requests, max_attempts)
+    configure_limit_store(cache_dir, limits_cache_ttl)
+    sessions = create_sessions(profile, region, regions, role_name, accounts)
+    configure_inventory(sessions=len(sessions))
+    configure_service_quotas(len(sessions))
 
     click.echo(
-        f'AWS profile: {session.profile_name} | AWS region: {session.region_name} | Active checks: {",".join([check.key for check in selected_checks])}')
+        f'AWS profile: {profile or sessions[0].profile_name} | AWS region: {",".join(sorted(set(session.region_name for session in sessions)))} | Active checks: {",".join([check.key for check in selected_checks])}')
 
+    check_classes = get_check_classes_by_session(sessions, selected_checks)
+    targets = [(session, chk) for session in sessions for chk in check_classes[session]]
     checks = []
 
-    with click.progressbar(selected_checks, label='Collecting checks', show_eta=False) as selected_checks:
-        for chk in selected_checks:
-            if issubclass(chk, InstanceQuotaCheck):
-                for identifier in chk.get_all_identifiers(session):
-                    checks.append(
-                        chk(session, identifier)
-                    )
-            else:
-                checks.append(chk(session))
-
-    Runner(session, checks, warning_threshold,
-           error_threshold, fail_on_warning).run_checks()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            click.progressbar(length=len(targets), label='Collecting checks', show_eta=False) as progress:
+        for collected in executor.map(lambda target: collect_checks(*target), targets):
+            checks += collected
+            progress.update(1)
+
+    Runner(checks, warning_threshold,
+           error_threshold, fail_on_warning, concurrency, service_concurrency).run_checks()
 
 
 @cli.command()
 @common_scope_options
+@common_client_options
+@common_cache_options
 @common_check_options
 @click.argument('check-key', type=click.Choice([chk.key for chk in ALL_INSTANCE_SCOPED_CHECKS]))
 @click.argument('instance-id')
-def check_instance(check_key, instance_id, region, profile, warning_threshold, error_threshold, fail_on_warning):
+def check_instance(check_key, instance_id, region, profile, max_pool_connections, tcp_keepalive, max_attempts, transport, max_concurrent_requests, cache_dir, limits_cache_ttl, warning_threshold, error_threshold, fail_on_warning):
     """Run single check for single instance
 
     e.g. check-instance vpc_acls_per_vpc vpc-0123456789
 
     Execute list-checks command to get available instance checks"""
 
+    configure_clients(max_pool_connections, tcp_keepalive, max_attempts)
+    configure_transport(transport, max_concurrent_requests, max_attempts)
+    configure_limit_store(cache_dir, limits_cache_ttl)
     session = boto3.Session(region_name=region, profile_name=profile)
 
     selected_check = next(
@@ -194,20 +324,28 @@ def check_instance(check_key, instance_id, region, profile, warning_threshold, e
 
     chk = selected_check(session, instance_id)
 
-    Runner(session, [chk], warning_threshold,
+    Runner([chk], warning_threshold,
            error_threshold, fail_on_warning).run_checks()
 
 
 @cli.command()
 @common_scope_options
+@regions_option
+@accounts_options
+@common_client_options
+@common_cache_options
 @click.option('--port', help='Port on which to expose the Prometheus /metrics endpoint, defaults to 8080', default=8080)
 @click.option('--namespace', help='Namespace/prefix for Prometheus metrics, defaults to awsquota', default='awsquota')
 @click.option('--limits-check-interval', help='Interval in seconds at which to check the limit quota value, defaults to 600', default=600)
-@click.option('--currents-check-interval', help='Interval in seconds at which to check the current quota value, defaults to 300', default=300)
+@click.option('--currents-check-interval', help='Minimum interval in seconds at which to check the current quota value, used for checks close to their limit, defaults to 300', default=300)
+@click.option('--max-currents-check-interval', help='Maximum interval in seconds at which to check the current quota value, used for checks far from their limit, defaults to 3600', default=3600)
 @click.option('--reload-checks-interval', help='Interval in seconds at which to collect new checks e.g. when a new resource has been created, defaults to 600', default=600)
 @click.option('--enable-duration-metrics/--disable-duration-metrics', help='Flag to control whether to collect/expose duration metrics, defaults to true', default=True)
+@click.option('--enable-gzip/--disable-gzip', help='Flag to control whether to gzip compress the /metrics response for clients that accept it, defaults to true', default=True)
+@click.option('--max-workers', help='Number of worker threads that execute checks in the background, defaults to 10', default=10)
+@click.option('--publish-interval', help='Minimum interval in seconds at which refreshed values are rendered for the /metrics endpoint, defaults to 15', default=15)
 @click.argument('check-keys')
-def prometheus_exporter(check_keys, region, profile, port, namespace, limits_check_interval, currents_check_interval, reload_checks_interval, enable_duration_metrics):
+def prometheus_exporter(check_keys, region, regions, role_name, accounts, profile, max_pool_connections, tcp_keepalive, max_attempts, transport, max_concurrent_requests, cache_dir, limits_cache_ttl, port, namespace, limits_check_interval, currents_check_interval, max_currents_check_interval, reload_checks_interval, enable_duration_metrics, enable_gzip, max_workers, publish_interval):
     """Start a Prometheus exporter for quota checks
 
     Set checks to execute with CHECK_KEYS
@@ -231,10 +369,19 @@ def prometheus_exporter(check_keys, region, profile, port, namespace, limits_che
 
     selected_checks = check_keys_to_check_classes(check_keys)
 
-    session = boto3.Session(region_name=region, profile_name=profile)
+    if bool(role_name) != bool(accounts):
+        raise click.UsageError('--role-name and --accounts have to be passed together')
+
+    configure_clients(max_pool_connections, tcp_keepalive, max_attempts)
+    configure_transport(transport, max_concurrent_requests, max_attempts)
+    configure_limit_store(cache_dir, limits_cache_ttl)
+    sessions = create_sessions(profile, region, regions, role_name, accounts)
+    # checks are refreshed individually, shared resource listings are fetched again at most once per interval
+    configure_inventory(currents_check_interval, len(sessions))
+    configure_service_quotas(len(sessions))
 
     click.echo(
-        f'AWS profile: {session.profile_name} | AWS region: {session.region_name} | Active checks: {",".join([check.key for check in selected_checks])}')
+        f'AWS profile: {profile or sessions[0].profile_name} | AWS region: {",".join(sorted(set(session.region_name for session in sessions)))} | Active checks: {",".join([check.key for check in selected_checks])}')
 
     settings = PrometheusExporterSettings(
         port=port,
@@ -242,10 +389,30 @@ def prometheus_exporter(check_keys, region, profile, port, namespace, limits_che
         get_currents_interval=currents_check_interval,
         get_limits_interval=limits_check_interval,
         reload_checks_interval=reload_checks_interval,
-        enable_duration_metrics=enable_duration_metrics
+        enable_duration_metrics=enable_duration_metrics,
+        max_workers=max_workers,
+        enable_gzip=enable_gzip,
+        max_currents_interval=max_currents_check_interval,
+        publish_interval=publish_interval
     )
 
-    PrometheusExporter(session, selected_checks, settings).start()
+    PrometheusExporter(sessions, selected_checks, settings).start()
+
+
+@cli.command()
+@click.option('--cache-dir', help='Directory in which quota limits are persisted', required=True)
+@click.option('--account', help='Only invalidate limits of this account ID')
+@click.option('--region', help='Only invalidate limits of this region')
+@click.option('--service-code', help='Only invalidate limits of this service, e.g. ec2')
+@click.option('--quota-code', help='Only invalidate limits with this quota code, e.g. L-1216C47A')
+def invalidate_limits(cache_dir, account, region, service_code, quota_code):
+    """Drop persisted quota limits so that they're fetched again on the next run
+
+    e.g. invalidate-limits --cache-dir ~/.cache/aws-quota-checker --service-code ec2"""
+    store = configure_limit_store(cache_dir)
+    invalidated = store.invalidate(account, region, service_code, quota_code)
+
+    click.echo(f'Invalidated {invalidated} limits')
 
 
 @cli.command()
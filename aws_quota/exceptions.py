@@ -8,3 +8,15 @@ class InstanceWithIdentifierNotFound(AwsQuotaCheckerException):
 
     def __str__(self) -> str:
         return f'check {self.check.key} could not find instance with ID "{self.check.instance_id}"'
+
+
+class ValuePending(AwsQuotaCheckerException):
+    """Raised by checks whose value is being looked up in the background
+
+    future is done once the lookup finished, the check can be evaluated again then.
+    """
+    def __init__(self, future) -> None:
+        self.future = future
+
+    def __str__(self) -> str:
+        return 'value is being looked up in the background'
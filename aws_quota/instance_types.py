@@ -0,0 +1,116 @@
+from aws_quota.limit_store import get_cache_dir
+from aws_quota.utils import paginate
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import typing
+
+import boto3
+
+# instance types are added a few times a year and never change their vCPU count
+CATALOGUE_TTL = 7 * 86400
+# instance types missing from a fresh catalogue are only looked up again after this
+UNKNOWN_TYPE_TTL = 86400
+CATALOGUE_DIR_NAME = 'instance-types'
+
+logger = logging.getLogger(__name__)
+
+_catalogues = {}
+# one lock per region, so that fetching the catalogue of a region doesn't block the others
+_region_locks = {}
+_region_locks_lock = threading.Lock()
+
+
+def _catalogue_path(region: str) -> typing.Optional[str]:
+    cache_dir = get_cache_dir()
+    return os.path.join(cache_dir, CATALOGUE_DIR_NAME, f'{region}.json') if cache_dir is not None else None
+
+
+def _load_catalogue(path: str) -> typing.Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _store_catalogue(path: str, catalogue: dict):
+    """Persists catalogue, if that fails, e.g. because the cache directory is full, it's only kept in memory"""
+    temporary_path = None
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first so that concurrent readers never see a partial catalogue
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), delete=False) as f:
+            temporary_path = f.name
+            json.dump(catalogue, f, separators=(',', ':'))
+
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logger.warning('failed to store the instance type catalogue in %s: %s', path, e)
+
+        if temporary_path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(temporary_path)
+
+
+def _fetch_vcpus(session: boto3.Session) -> typing.Dict[str, int]:
+    return {instance_type['InstanceType']: instance_type['VCpuInfo']['DefaultVCpus']
+            for instance_type in paginate(session, 'ec2', 'describe_instance_types', 'InstanceTypes', page_size=100)}
+
+
+def _is_outdated(catalogue: typing.Optional[dict], instance_types: typing.Iterable[str]) -> bool:
+    """Whether catalogue is expired or lacks one of instance_types that hasn't been looked up recently"""
+    if catalogue is None or time.time() - catalogue['fetched_at'] > CATALOGUE_TTL:
+        return True
+
+    unknown = catalogue.get('unknown', {})
+
+    return any(instance_type not in catalogue['vcpus'] and time.time() - unknown.get(instance_type, 0) > UNKNOWN_TYPE_TTL
+               for instance_type in instance_types)
+
+
+def get_instance_type_vcpus(session: boto3.Session, instance_types: typing.Iterable[str] = ()) -> typing.Dict[str, int]:
+    """Returns the default vCPU count per instance type of the session's region
+
+    The catalogue is loaded lazily, kept in memory and, if --cache-dir is set, on disk for
+    CATALOGUE_TTL. It's fetched again if one of instance_types isn't part of it, e.g.
+    because it has been released after the catalogue was fetched. Instance types that
+    are still missing afterwards are remembered as unknown for UNKNOWN_TYPE_TTL and left
+    out of the result.
+    """
+    region = session.region_name
+    path = _catalogue_path(region)
+    instance_types = set(instance_types)
+
+    with _region_locks_lock:
+        region_lock = _region_locks.setdefault(region, threading.Lock())
+
+    with region_lock:
+        catalogue = _catalogues.get(region)
+
+        if catalogue is None and path is not None:
+            catalogue = _load_catalogue(path)
+
+        if not _is_outdated(catalogue, instance_types):
+            _catalogues[region] = catalogue
+            return catalogue['vcpus']
+
+        now = time.time()
+        vcpus = _fetch_vcpus(session)
+        unknown = {instance_type: checked_at for instance_type, checked_at in (catalogue or {}).get('unknown', {}).items()
+                   if instance_type not in vcpus and now - checked_at <= UNKNOWN_TYPE_TTL}
+        unknown.update((instance_type, now) for instance_type in instance_types.difference(vcpus))
+
+        catalogue = {'fetched_at': now, 'vcpus': vcpus, 'unknown': unknown}
+        _catalogues[region] = catalogue
+
+        if path is not None:
+            _store_catalogue(path, catalogue)
+
+        return vcpus
@@ -0,0 +1,160 @@
+from aws_quota.utils import get_account_id
+import collections
+import functools
+import threading
+import time
+import typing
+
+import boto3
+
+_MISSING = object()
+# lower bound of the number of entries kept, no matter how few sessions are checked
+MIN_MAXSIZE = 4096
+
+
+class Inventory:
+    """Cache for AWS resource listings that are shared by multiple checks
+
+    Entries are keyed by account, region and resource type and stay valid until they're
+    cleared or, if set, their TTL expires. Entries derived from other entries, e.g. an
+    index by ID of a listing, expire along with them. Concurrent lookups of the same
+    missing entry only trigger a single fetch. Once there are more entries than resource
+    types of all sessions, the least recently used ones are evicted.
+    """
+
+    def __init__(self, ttl: float = None, sessions: int = 1) -> None:
+        self.ttl = ttl
+        self.sessions = sessions
+        # resource types of the cached functions, there's at most one entry per type and session
+        self.resource_types = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._fetch_locks = {}
+        self._lock = threading.Lock()
+        # entries looked up by the fetches running on the current thread
+        self._local = threading.local()
+
+    @property
+    def maxsize(self) -> int:
+        return max(MIN_MAXSIZE, self.sessions * len(self.resource_types))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._fetch_locks.clear()
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def __is_valid(self, key) -> bool:
+        timestamp, _, dependencies = self._entries[key]
+
+        if self.ttl is not None and time.monotonic() - timestamp > self.ttl:
+            return False
+
+        # an entry is only valid as long as the entries it was derived from haven't been replaced
+        return all(dependency in self._entries and self._entries[dependency][0] == dependency_timestamp
+                   for dependency, dependency_timestamp in dependencies)
+
+    def __lookup(self, key):
+        if key not in self._entries:
+            return _MISSING
+
+        if not self.__is_valid(key):
+            del self._entries[key]
+            self.evictions += 1
+            return _MISSING
+
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def __store(self, key, value, dependencies: tuple):
+        # derived entries are as old as the oldest entry they were derived from
+        timestamp = min([time.monotonic()] + [dependency_timestamp for _, dependency_timestamp in dependencies])
+        self._entries[key] = (timestamp, value, dependencies)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        return self._entries[key]
+
+    def __record_dependency(self, key, timestamp: float):
+        fetches = getattr(self._local, 'fetches', None)
+
+        if fetches:
+            fetches[-1].append((key, timestamp))
+
+    def __fetch(self, session: boto3.Session, key, fetch: typing.Callable[[boto3.Session], typing.Any]):
+        """Fetches and stores the entry of key along with the entries the fetch looked up"""
+        fetches = getattr(self._local, 'fetches', None)
+
+        if fetches is None:
+            fetches = self._local.fetches = []
+
+        fetches.append([])
+
+        try:
+            value = fetch(session)
+        finally:
+            dependencies = tuple(fetches.pop())
+
+        with self._lock:
+            return self.__store(key, value, dependencies)
+
+    def get(self, session: boto3.Session, resource_type: str, fetch: typing.Callable[[boto3.Session], typing.Any]):
+        key = (get_account_id(session), session.region_name, resource_type)
+
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+
+        with fetch_lock:
+            with self._lock:
+                entry = self.__lookup(key)
+
+                if entry is _MISSING:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+
+            if entry is _MISSING:
+                entry = self.__fetch(session, key, fetch)
+
+        timestamp, value, _ = entry
+        self.__record_dependency(key, timestamp)
+
+        return value
+
+    def cached(self, resource_type: str):
+        """Decorator for functions that take a session and return the resources of the given type"""
+        self.resource_types.add(resource_type)
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(session: boto3.Session):
+                return self.get(session, resource_type, func)
+
+            return wrapper
+
+        return decorator
+
+
+inventory = Inventory()
+
+
+def configure_inventory(ttl: float = None, sessions: int = 1):
+    """Sets the time in seconds after which resource listings are fetched again and the number of sessions to keep them for
+
+    Listings are kept for the whole run by default.
+    """
+    inventory.ttl = ttl
+    inventory.sessions = sessions
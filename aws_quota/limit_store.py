@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+DEFAULT_TTL = 86400
+DATABASE_FILE_NAME = 'limits.sqlite3'
+
+_limit_store = None
+_cache_dir = None
+
+
+class LimitStore:
+    """Persistent store for quota limits backed by SQLite
+
+    Limits are keyed by account, region, service code and quota code and are considered
+    stale ttl seconds after they have been fetched. The database can be shared by several
+    processes, e.g. a check run and a Prometheus exporter.
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS limits (
+                    account_id TEXT NOT NULL,
+                    region TEXT NOT NULL,
+                    service_code TEXT NOT NULL,
+                    quota_code TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (account_id, region, service_code, quota_code)
+                )
+            ''')
+
+    def get(self, account_id: str, region: str, service_code: str, quota_code: str) -> typing.Optional[float]:
+        """Returns the stored limit or None if it's unknown or has expired"""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value FROM limits WHERE account_id = ? AND region = ? AND service_code = ? AND quota_code = ? AND fetched_at >= ?',
+                (account_id, region or '', service_code, quota_code, time.time() - self.ttl)
+            ).fetchone()
+
+        return row[0] if row is not None else None
+
+    def put(self, account_id: str, region: str, service_code: str, quota_code: str, value: float):
+        self.put_many(account_id, region, service_code, {quota_code: value})
+
+    def put_many(self, account_id: str, region: str, service_code: str, quotas: typing.Dict[str, float]):
+        """Stores the limits of a service indexed by quota code"""
+        fetched_at = time.time()
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO limits VALUES (?, ?, ?, ?, ?, ?)',
+                [(account_id, region or '', service_code, quota_code, value, fetched_at)
+                 for quota_code, value in quotas.items()]
+            )
+
+    def invalidate(self,
+                   account_id: str = None,
+                   region: str = None,
+                   service_code: str = None,
+                   quota_code: str = None) -> int:
+        """Deletes the limits matching all given arguments, all of them if none is set
+
+        Returns the number of deleted limits.
+        """
+        filters = {
+            'account_id': account_id,
+            'region': region,
+            'service_code': service_code,
+            'quota_code': quota_code
+        }
+        conditions = [(f'{column} = ?', value) for column, value in filters.items() if value is not None]
+        where = ' AND '.join(condition for condition, _ in conditions) or '1'
+
+        with self._lock, self._connection:
+            return self._connection.execute(
+                f'DELETE FROM limits WHERE {where}', [value for _, value in conditions]
+            ).rowcount
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def configure_limit_store(cache_dir: typing.Optional[str], ttl: float = DEFAULT_TTL) -> typing.Optional[LimitStore]:
+    """Sets the limit store used by all quota checks, passing no cache_dir disables it"""
+    global _limit_store, _cache_dir
+
+    if _limit_store is not None:
+        _limit_store.close()
+        _limit_store = None
+
+    _cache_dir = cache_dir
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        _limit_store = LimitStore(os.path.join(cache_dir, DATABASE_FILE_NAME), ttl)
+
+    return _limit_store
+
+
+def get_limit_store() -> typing.Optional[LimitStore]:
+    return _limit_store
+
+
+def get_cache_dir() -> typing.Optional[str]:
+    """Returns the directory passed with --cache-dir, if any"""
+    return _cache_dir
@@ -1,20 +1,48 @@
 import asyncio
-from aws_quota.exceptions import InstanceWithIdentifierNotFound
+import concurrent.futures
+from aws_quota.exceptions import InstanceWithIdentifierNotFound, ValuePending
+from aws_quota.inventory import inventory
+from aws_quota.rate_limit import rate_limiter
+from aws_quota.scheduler import AdaptiveScheduler
+from aws_quota.sessions import get_check_classes_by_session
 from aws_quota.utils import get_account_id
 import dataclasses
+import gzip
+import http.server
 import logging
 import signal
+import threading
 import time
 import contextlib
 import typing
 
-from aws_quota.check.quota_check import InstanceQuotaCheck, QuotaCheck
+from aws_quota.check.quota_check import InstanceQuotaCheck, QuotaCheck, refresh_service_quotas
+from aws_quota.check.route53 import limit_fetcher
 
 import boto3
 import prometheus_client as prom
 
 logger = logging.getLogger(__name__)
 
+INVENTORY_STATS_DOCUMENTATION = {
+    'entries': 'Number of resource listings in the inventory cache',
+    'hits': 'Number of inventory lookups served from the cache',
+    'misses': 'Number of inventory lookups that required a request to AWS',
+    'evictions': 'Number of inventory entries dropped because they were outdated or the cache was full'
+}
+ROUTE53_LIMIT_FETCHER_STATS_DOCUMENTATION = {
+    'entries': 'Number of cached Route53 account and hosted zone limit lookups',
+    'fetches': 'Number of Route53 limit lookups sent to AWS',
+    'hits': 'Number of Route53 limit lookups served from the cache',
+    'in_flight': 'Number of Route53 limit lookups waiting for their turn or a response'
+}
+
+RATE_LIMITER_STATS_DOCUMENTATION = {
+    'throttles': 'Number of AWS API requests that have been throttled',
+    'wait_seconds': 'Time AWS API requests have been delayed by the client side rate limiter',
+    'rate': 'Current client side rate limit in requests per second, -1 if unlimited'
+}
+
 
 @dataclasses.dataclass
 class PrometheusExporterSettings:
@@ -24,39 +52,138 @@ class PrometheusExporterSettings:
     get_limits_interval: int
     reload_checks_interval: int
     enable_duration_metrics: bool
+    max_workers: int = 10
+    enable_gzip: bool = True
+    max_currents_interval: int = 3600
+    publish_interval: int = 15
+
+
+class ResultsCollector:
+    """Prometheus collector that serves all metrics from an immutable snapshot
+
+    Values are staged with set and become visible once publish is called. publish
+    renders the exposition format once, scrapes are answered with the rendered bytes
+    no matter how many series there are.
+    """
+
+    def __init__(self, enable_gzip: bool = True) -> None:
+        self.enable_gzip = enable_gzip
+        self.registry = prom.CollectorRegistry(auto_describe=False)
+        self.registry.register(self)
+        self._metrics = {}
+        self._snapshot = ()
+        self._exposition = self.render()
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+
+    def set(self, name: str, documentation: str, labels: typing.Dict[str, str], value: float):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = (documentation, tuple(labels.keys()), {})
+
+            _, labelnames, values = self._metrics[name]
+            values[tuple(str(labels[label]) for label in labelnames)] = value
+
+    def remove(self, name: str, labels: typing.Dict[str, str]):
+        """Drops a series, metrics without any series left are dropped as well"""
+        with self._lock:
+            if name not in self._metrics:
+                return
+
+            _, labelnames, values = self._metrics[name]
+            values.pop(tuple(str(labels[label]) for label in labelnames), None)
+
+            if not values:
+                del self._metrics[name]
+
+    def series_count(self, exclude: str = None) -> int:
+        """Number of series set so far, without the series of the metric exclude"""
+        with self._lock:
+            return sum(len(values) for name, (_, _, values) in self._metrics.items() if name != exclude)
+
+    def publish(self):
+        """Makes the values set so far visible to scrapes"""
+        with self._publish_lock:
+            with self._lock:
+                self._snapshot = tuple((name, documentation, labelnames, tuple(values.items()))
+                                       for name, (documentation, labelnames, values) in self._metrics.items())
+
+            self._exposition = self.render()
+
+    def render(self) -> typing.Tuple[bytes, typing.Optional[bytes]]:
+        exposition = prom.generate_latest(self.registry)
+        return exposition, gzip.compress(exposition, compresslevel=6) if self.enable_gzip else None
+
+    def exposition(self, gzipped: bool = False) -> bytes:
+        plain, compressed = self._exposition
+        return compressed if gzipped and compressed is not None else plain
+
+    def collect(self):
+        for name, documentation, labelnames, values in self._snapshot:
+            family = prom.metrics_core.GaugeMetricFamily(name, documentation, labels=labelnames)
+
+            for label_values, value in values:
+                family.add_metric(label_values, value)
+
+            yield family
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every GET request with the last published exposition of server.collector"""
+
+    def do_GET(self):
+        collector = self.server.collector
+        gzipped = collector.enable_gzip and 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = collector.exposition(gzipped)
+
+        self.send_response(200)
+        self.send_header('Content-Type', prom.CONTENT_TYPE_LATEST)
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
 
 
 class PrometheusExporter:
+
     def __init__(self,
-                 session: boto3.Session,
+                 sessions: typing.List[boto3.Session],
                  check_classes: typing.List[QuotaCheck],
                  settings: PrometheusExporterSettings):
-        self.session = session
-        self.check_classes = check_classes
-        self.checks = []
+        self.sessions = sessions
+        self.check_classes = get_check_classes_by_session(sessions, check_classes)
+        # immutable snapshots of the active checks, replaced as a whole on every change
+        self.checks = {session: () for session in sessions}
+        self.check_index = {session: {} for session in sessions}
+        # serializes storing the results of a check with dropping its series once it's obsolete
+        self.results_lock = threading.Lock()
         self.settings = settings
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=settings.max_workers)
+        self.checks_loaded = None
+        self.results_changed = None
+        self.results = ResultsCollector(settings.enable_gzip)
+        self.schedulers = {
+            session: AdaptiveScheduler(settings.get_currents_interval, settings.max_currents_interval) for session in sessions
+        }
 
-        # unregister default collectors
-        for name in list(prom.REGISTRY._names_to_collectors.values()):
-            with contextlib.suppress(KeyError):
-                prom.REGISTRY.unregister(name)
+        for session in sessions:
+            self.results.set(f'{self.settings.namespace}_info', 'AWS quota checker info', self.default_labels(session), 1)
 
-        prom.Info(f'{self.settings.namespace}', 'AWS quota checker info').info({
-            **self.default_labels
-        })
+        self.results.publish()
 
-    @property
-    def default_labels(self):
+    @staticmethod
+    def default_labels(session: boto3.Session):
         return {
-            'account': get_account_id(self.session),
-            'region': self.session.region_name
+            'account': get_account_id(session),
+            'region': session.region_name
         }
 
     @contextlib.contextmanager
-    def timeit_gauge(self, prefix: str, labels: dict = None, **kwargs):
-        if labels is None:
-            labels = self.default_labels
-
+    def timeit_gauge(self, prefix: str, labels: dict, documentation: str):
         start = time.time()
         try:
             yield
@@ -64,142 +191,281 @@ class PrometheusExporter:
             duration = time.time() - start
 
             if self.settings.enable_duration_metrics:
-                PrometheusExporter.get_or_create_gauge(
-                    name=f'{prefix}_duration_seconds',
-                    labelnames=labels.keys(),
-                    **kwargs).labels(**labels).set(duration)
+                self.results.set(f'{prefix}_duration_seconds', documentation, labels, duration)
+
+    def is_active(self, check: QuotaCheck) -> bool:
+        return self.check_index[check.boto_session].get(self.check_identity(check)) is check
+
+    def drop_obsolete_checks(self, session: boto3.Session, checks: typing.Iterable[QuotaCheck]):
+        """Removes the series of checks of session that are no longer active"""
+        # duration series are shared by all instances of a check
+        active_classes = {type(check) for check in self.checks[session]}
+
+        with self.results_lock:
+            for check in checks:
+                prefix = f'{self.settings.namespace}_{check.key}'
+
+                for name in [prefix, f'{prefix}_limit', f'{prefix}_interval_seconds']:
+                    self.results.remove(name, check.label_values)
+
+                if type(check) not in active_classes:
+                    for name in [prefix, f'{prefix}_limit']:
+                        self.results.remove(f'{name}_duration_seconds', self.default_labels(session))
+
+    async def publish_results(self):
+        """Makes the results set so far visible to scrapes, jobs mark results as changed instead"""
+        name = f'{self.settings.namespace}_series_count'
+        # all other series plus the series count itself
+        self.results.set(name, 'Number of series exposed by the exporter', {}, self.results.series_count(exclude=name) + 1)
+        await self.run_in_executor(self.results.publish)
+
+    async def run_in_executor(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
 
     @staticmethod
-    def get_or_create_gauge(name, **kwargs) -> prom.Gauge:
-        if name in prom.REGISTRY._names_to_collectors:
-            return prom.REGISTRY._names_to_collectors[name]
+    def check_identity(check: QuotaCheck) -> typing.Tuple[type, typing.Optional[str]]:
+        return type(check), getattr(check, 'instance_id', None)
+
+    def publish_checks(self, session: boto3.Session, checks: typing.Iterable[QuotaCheck]):
+        """Replaces the active checks of session with a new snapshot"""
+        checks = tuple(checks)
+        self.check_index[session] = {self.check_identity(check): check for check in checks}
+        self.checks[session] = checks
+
+    def collect_checks(self, session: boto3.Session, check_class: QuotaCheck) -> typing.List[QuotaCheck]:
+        """Returns the checks of check_class, existing check objects are reused
+
+        If listing the identifiers fails, the previously known checks are kept.
+        """
+        known = self.check_index[session]
+
+        try:
+            if issubclass(check_class, InstanceQuotaCheck):
+                identifiers = check_class.get_all_identifiers(session)
+            else:
+                identifiers = [None]
+        except Exception:
+            logger.error('failed to collect check %s in region %s', check_class, session.region_name)
+            return [check for (cls, _), check in known.items() if cls is check_class]
+
+        checks = []
+
+        for identifier in identifiers:
+            check = known.get((check_class, identifier))
+
+            if check is None:
+                check = check_class(session, identifier) if identifier is not None else check_class(session)
 
-        return prom.Gauge(name, **kwargs)
+            checks.append(check)
 
-    def drop_obsolete_check(self):
-        raise NotImplementedError
+        return checks
 
-    async def load_checks_job(self):
-        g = PrometheusExporter.get_or_create_gauge(
-            f'{self.settings.namespace}_check_count',
-            documentation='Number of AWS Quota Checks'
-        )
+    def refresh_value(self,
+                      check: QuotaCheck,
+                      name: str,
+                      description: str,
+                      get: typing.Callable[[], float],
+                      observe: typing.Callable[[float, float], None]) -> bool:
+        """Updates the gauge name with the value returned by get, returns False if the check is obsolete
 
+        observe is called with the value and the seconds it took to get it.
+        """
+        labels = check.label_values
+
+        try:
+            start = time.monotonic()
+
+            with self.timeit_gauge(
+                name,
+                self.default_labels(check.boto_session),
+                documentation=f'Time to collect {description}'
+            ):
+                value = get()
+
+            # the check may have been dropped while it was refreshed, its series must not come back
+            with self.results_lock:
+                if self.is_active(check):
+                    self.results.set(name, description, labels, value)
+                    observe(value, time.monotonic() - start)
+        except InstanceWithIdentifierNotFound as e:
+            logger.warn(
+                'instance with identifier %s does not exist anymore, dropping it...', e.check.instance_id)
+            return False
+        except ValuePending:
+            raise
+        except Exception:
+            logger.error(
+                'getting %s of quota %s failed', description, check)
+
+        return True
+
+    def refresh_limit(self, check: QuotaCheck) -> bool:
+        """Updates the limit gauge of the check, returns False if the check is obsolete"""
+        scheduler = self.schedulers[check.boto_session]
+
+        return self.refresh_value(check, f'{self.settings.namespace}_{check.key}_limit', f'{check.description} Limit',
+                                  lambda: check.maximum, lambda value, _: scheduler.observe_maximum(check, value))
+
+    def refresh_current(self, check: QuotaCheck) -> bool:
+        """Updates the current value gauge of the check, returns False if the check is obsolete"""
+        scheduler = self.schedulers[check.boto_session]
+
+        return self.refresh_value(check, f'{self.settings.namespace}_{check.key}', check.description,
+                                  lambda: check.current, lambda value, duration: scheduler.observe_current(check, value, duration))
+
+    async def refresh_when_available(self, refresh: typing.Callable[[QuotaCheck], bool], check: QuotaCheck) -> bool:
+        """Runs refresh on a worker, values looked up in the background are awaited without holding one"""
+        while True:
+            try:
+                return await self.run_in_executor(refresh, check)
+            except ValuePending as e:
+                await asyncio.wait([asyncio.wrap_future(e.future)])
+
+    async def refresh_checks(self,
+                             session: boto3.Session,
+                             refresh: typing.Callable[[QuotaCheck], bool],
+                             checks: typing.Sequence[QuotaCheck] = None) -> typing.List[QuotaCheck]:
+        """Refreshes checks, all active ones by default, and returns the ones that aren't obsolete"""
+        checks = checks if checks is not None else self.checks[session]
+        results = await asyncio.gather(*[self.refresh_when_available(refresh, check) for check in checks])
+        obsolete = {check for check, keep in zip(checks, results) if not keep}
+
+        if obsolete:
+            self.publish_checks(session, [check for check in self.checks[session] if check not in obsolete])
+            self.drop_obsolete_checks(session, obsolete)
+
+        return [check for check in checks if check not in obsolete]
+
+    def publish_intervals(self, session: boto3.Session, checks: typing.Iterable[QuotaCheck]):
+        for check, interval in self.schedulers[session].intervals(checks).items():
+            self.results.set(f'{self.settings.namespace}_{check.key}_interval_seconds',
+                             f'Interval at which {check.description} is refreshed', check.label_values, interval)
+
+    def publish_inventory_stats(self):
+        for stat, value in inventory.stats().items():
+            self.results.set(f'{self.settings.namespace}_inventory_{stat}', INVENTORY_STATS_DOCUMENTATION[stat], {}, value)
+
+    def publish_route53_limit_fetcher_stats(self):
+        for stat, value in limit_fetcher.stats().items():
+            self.results.set(f'{self.settings.namespace}_route53_limit_lookups_{stat}',
+                             ROUTE53_LIMIT_FETCHER_STATS_DOCUMENTATION[stat], {}, value)
+
+    def publish_rate_limiter_stats(self):
+        for labels, bucket in rate_limiter.stats():
+            stats = {
+                'throttles': bucket.throttles,
+                'wait_seconds': bucket.wait_seconds,
+                'rate': bucket.rate if bucket.rate is not None else -1
+            }
+
+            for stat, value in stats.items():
+                self.results.set(f'{self.settings.namespace}_api_{stat}', RATE_LIMITER_STATS_DOCUMENTATION[stat], labels, value)
+
+    async def load_checks_job(self, session: boto3.Session):
         while True:
             with self.timeit_gauge(
                 f'{self.settings.namespace}_collect_checks',
+                self.default_labels(session),
                 documentation='Time to collect all quota checks'
             ):
-                logger.info('collecting checks')
-                checks = []
-                for chk in self.check_classes:
-                    try:
-                        if issubclass(chk, InstanceQuotaCheck):
-                            for identifier in chk.get_all_identifiers(self.session):
-                                checks.append(
-                                    chk(self.session, identifier)
-                                )
-                        else:
-                            checks.append(chk(self.session))
-                    except Exception:
-                        logger.error('failed to collect check %s', chk)
-
-                g.set(len(checks))
-                self.checks = checks
-                logger.info(f'collected {len(checks)} checks')
+                logger.info('collecting checks in region %s', session.region_name)
+                collected = await asyncio.gather(*[self.run_in_executor(self.collect_checks, session, chk)
+                                                   for chk in self.check_classes[session]])
+                checks = [check for checks_of_class in collected for check in checks_of_class]
+                previous = set(self.checks[session])
+                added = sum(1 for check in checks if check not in previous)
+                removed = previous.difference(checks)
+
+                self.publish_checks(session, checks)
+                self.drop_obsolete_checks(session, removed)
+
+                self.results.set(f'{self.settings.namespace}_check_count', 'Number of AWS Quota Checks', {},
+                                 sum(len(checks) for checks in self.checks.values()))
+                self.checks_loaded[session].set()
+                logger.info('collected %d checks in region %s, %d added, %d removed',
+                            len(checks), session.region_name, added, len(removed))
+
+            self.results_changed.set()
             await asyncio.sleep(self.settings.reload_checks_interval)
 
-    async def get_limits_job(self):
+    async def get_limits_job(self, session: boto3.Session):
+        await self.checks_loaded[session].wait()
 
         while True:
             with self.timeit_gauge(
                 f'{self.settings.namespace}_check_limits',
+                self.default_labels(session),
                 documentation='Time to check limits of all quotas'
             ):
-                logger.info('refreshing limits')
-                checks_to_drop = []
-
-                for check in self.checks:
-                    labels = check.label_values
-                    name = f'{self.settings.namespace}_{check.key}_limit'
-
-                    try:
-                        with self.timeit_gauge(
-                            name,
-                            documentation=f'Time to collect {check.description} Limit'
-                        ):
-                            value = check.maximum
-
-                        PrometheusExporter.get_or_create_gauge(
-                            name,
-                            documentation=f'{check.description} Limit',
-                            labelnames=labels.keys()
-                        ).labels(**check.label_values).set(value)
-                    except InstanceWithIdentifierNotFound as e:
-                        logger.warn(
-                            'instance with identifier %s does not exist anymore, dropping it...', e.check.instance_id)
-                        checks_to_drop.append(e.check)
-                    except Exception:
-                        logger.error(
-                            'getting maximum of quota %s failed', check)
-
-                for check in checks_to_drop:
-                    self.checks.remove(check)
-
-            logger.info('limits refreshed')
+                logger.info('refreshing limits in region %s', session.region_name)
+                # limits persisted with --cache-dir are kept until their TTL expires
+                refresh_service_quotas(session)
+                await self.refresh_checks(session, self.refresh_limit)
+                self.publish_rate_limiter_stats()
+                self.publish_route53_limit_fetcher_stats()
+
+            self.results_changed.set()
+            logger.info('limits refreshed in region %s', session.region_name)
             await asyncio.sleep(self.settings.get_limits_interval)
 
-    async def get_currents_job(self):
+    async def get_currents_job(self, session: boto3.Session):
+        await self.checks_loaded[session].wait()
+        scheduler = self.schedulers[session]
 
         while True:
-            with self.timeit_gauge(
-                f'{self.settings.namespace}_check_currents',
-                documentation='Time to check limits of all quotas'
-            ):
-
-                logger.info('refreshing current values')
-                checks_to_drop = []
-                for check in self.checks:
-                    labels = check.label_values
-                    name = f'{self.settings.namespace}_{check.key}'
-
-                    try:
-                        with self.timeit_gauge(
-                            name,
-                            documentation=f'Time to collect {check.description}'
-                        ):
-                            value = check.current
-
-                        PrometheusExporter.get_or_create_gauge(
-                            name,
-                            documentation=check.description,
-                            labelnames=labels.keys()
-                        ).labels(**check.label_values).set(value)
-                    except InstanceWithIdentifierNotFound as e:
-                        logger.warn(
-                            'instance with identifier %s does not exist anymore, dropping it...', e.check.instance_id)
-                        checks_to_drop.append(e.check)
-                    except Exception:
-                        logger.error(
-                            'getting maximum of quota %s failed', check)
-
-                for check in checks_to_drop:
-                    self.checks.remove(check)
-
-            logger.info('current values refreshed')
-            await asyncio.sleep(self.settings.get_currents_interval)
+            scheduler.sync(self.checks[session])
+            due = scheduler.pop_due()
+
+            if due:
+                with self.timeit_gauge(
+                    f'{self.settings.namespace}_check_currents',
+                    self.default_labels(session),
+                    documentation='Time to check current values of all due quotas'
+                ):
+                    logger.info('refreshing %d current values in region %s', len(due), session.region_name)
+                    refreshed = await self.refresh_checks(session, self.refresh_current, due)
+                    scheduler.reschedule(refreshed)
+                    self.publish_intervals(session, refreshed)
+                    self.publish_inventory_stats()
+                    self.publish_rate_limiter_stats()
+                    self.publish_route53_limit_fetcher_stats()
+
+                self.results_changed.set()
+                logger.info('current values refreshed in region %s', session.region_name)
+
+            # wake up regularly to pick up checks that have been discovered in the meantime
+            next_due = scheduler.seconds_until_due()
+            await asyncio.sleep(min(next_due, self.settings.get_currents_interval)
+                                if next_due is not None else self.settings.get_currents_interval)
+
+    async def publish_job(self):
+        """Renders the results once they've changed, at most once per publish interval"""
+        while True:
+            await self.results_changed.wait()
+            self.results_changed.clear()
+            await self.publish_results()
+            await asyncio.sleep(self.settings.publish_interval)
 
     def serve(self):
         logger.info(f'starting /metrics endpoint on port {self.settings.port}')
-        prom.start_http_server(self.settings.port)
+        server = http.server.ThreadingHTTPServer(('', self.settings.port), MetricsHandler)
+        server.daemon_threads = True
+        server.collector = self.results
+        threading.Thread(target=server.serve_forever, daemon=True).start()
 
     async def background_jobs(self):
-        await asyncio.gather(
-            self.load_checks_job(),
-            self.get_limits_job(),
-            self.get_currents_job(),
-            return_exceptions=True
-        )
+        self.checks_loaded = {session: asyncio.Event() for session in self.sessions}
+        self.results_changed = asyncio.Event()
+        jobs = [self.publish_job()]
+
+        for session in self.sessions:
+            jobs += [
+                self.load_checks_job(session),
+                self.get_limits_job(session),
+                self.get_currents_job(session)
+            ]
+
+        await asyncio.gather(*jobs, return_exceptions=True)
 
     def start(self):
         self.serve()
@@ -207,3 +473,5 @@ class PrometheusExporter:
             asyncio.run(self.background_jobs())
         except KeyboardInterrupt:
             logger.info('shutting down...')
+        finally:
+            self.executor.shutdown(wait=False)
@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+import typing
+
+import botocore.client
+
+# request rates per second of APIs with low account wide limits, all operations share one budget
+SERVICE_RATES = {
+    'route53': 5.0,
+    'iam': 10.0,
+    'organizations': 5.0
+}
+
+# rate an unlimited operation falls back to once it gets throttled
+THROTTLED_RATE = 10.0
+MIN_RATE = 0.5
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 1.0
+
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'TransactionInProgressException',
+    'RequestLimitExceeded',
+    'BandwidthLimitExceeded',
+    'LimitExceededException',
+    'RequestThrottled',
+    'SlowDown',
+    'PriorRequestNotComplete',
+    'EC2ThrottledException'
+])
+
+
+class TokenBucket:
+    """Token bucket with AIMD rate adaptation
+
+    The rate is halved when a request gets throttled and grows by roughly one request per
+    second every second while requests succeed, up to max_rate. A rate of None doesn't
+    limit requests until the first throttle.
+    """
+
+    def __init__(self, rate: float = None, max_rate: float = None) -> None:
+        self.rate = rate
+        self.max_rate = max_rate
+        self.tokens = self.burst
+        self.throttles = 0
+        self.wait_seconds = 0.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def burst(self) -> float:
+        return max(1.0, self.rate) if self.rate is not None else 0.0
+
+    def acquire(self) -> float:
+        """Blocks until a request may be sent, returns the time waited in seconds"""
+        wait = self.reserve()
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return wait
+
+    def reserve(self) -> float:
+        """Reserves a slot for a request and returns the seconds the caller has to wait for it"""
+        with self._lock:
+            if self.rate is None:
+                return 0.0
+
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+
+            # tokens may become negative, callers reserve their slot and wait for it
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.wait_seconds += wait
+
+        return wait
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+
+            # concurrent requests are throttled in bursts, only back off once per burst
+            if now - self._last_decrease < DECREASE_COOLDOWN:
+                return
+
+            self._last_decrease = now
+
+            if self.rate is None:
+                self.rate = THROTTLED_RATE
+            else:
+                self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+
+            self.tokens = min(self.tokens, self.burst)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate is None:
+                return
+
+            rate = self.rate + 1.0 / self.rate
+            self.rate = min(rate, self.max_rate) if self.max_rate is not None else rate
+
+
+class RateLimiter:
+    """Registry of token buckets per account, region, service and API operation
+
+    Services listed in SERVICE_RATES are limited account wide, hence their operations
+    share one bucket per account regardless of the region.
+    """
+
+    def __init__(self, service_rates: typing.Dict[str, float] = SERVICE_RATES) -> None:
+        self.service_rates = dict(service_rates)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, account_id: str, region: str, service: str, operation: str) -> TokenBucket:
+        if service in self.service_rates:
+            key = (account_id, '', service, '')
+        else:
+            key = (account_id, region or '', service, operation)
+
+        with self._lock:
+            if key not in self._buckets:
+                rate = self.service_rates.get(service)
+                self._buckets[key] = TokenBucket(rate, rate)
+
+            return self._buckets[key]
+
+    def register(self, client: botocore.client.BaseClient, service: str, get_account_id: typing.Callable[[], str]):
+        """Limits the requests of client, retries included, and adapts to throttling responses"""
+        def before_request(operation_name, **kwargs):
+            self.__bucket_of(client, service, get_account_id, operation_name).acquire()
+
+        self.__register(client, service, get_account_id, before_request)
+
+    def register_async(self, client: botocore.client.BaseClient, service: str, get_account_id: typing.Callable[[], str]):
+        """Like register, but for aiobotocore clients whose requests must not block the event loop"""
+        async def before_request(operation_name, **kwargs):
+            wait = self.__bucket_of(client, service, get_account_id, operation_name).reserve()
+
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        self.__register(client, service, get_account_id, before_request)
+
+    def __bucket_of(self, client: botocore.client.BaseClient, service: str, get_account_id: typing.Callable[[], str], operation: str) -> TokenBucket:
+        return self.bucket(get_account_id(), client.meta.region_name, service, operation)
+
+    def __register(self, client: botocore.client.BaseClient, service: str, get_account_id: typing.Callable[[], str], before_request: typing.Callable):
+        def after_response(response, operation, caught_exception=None, **kwargs):
+            if caught_exception is not None or response is None:
+                return
+
+            http_response, parsed = response
+            bucket = self.__bucket_of(client, service, get_account_id, operation.name)
+
+            if parsed.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+                bucket.on_throttle()
+            elif http_response.status_code < 400:
+                bucket.on_success()
+
+        # registered first so that requests wait before being signed and botocore's retry
+        # handler can't swallow the event
+        client.meta.events.register_first('request-created', before_request)
+        client.meta.events.register_first('needs-retry', after_response)
+
+    def stats(self) -> typing.List[typing.Tuple[typing.Dict[str, str], TokenBucket]]:
+        """Returns the labels and bucket of every limited operation"""
+        with self._lock:
+            return [({'account': account_id, 'region': region, 'service': service, 'operation': operation}, bucket)
+                    for (account_id, region, service, operation), bucket in self._buckets.items()]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+rate_limiter = RateLimiter()
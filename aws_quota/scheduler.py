@@ -0,0 +1,155 @@
+import dataclasses
+import heapq
+import itertools
+import threading
+import time
+import typing
+
+from aws_quota.check.quota_check import QuotaCheck
+
+# a check may spend at most 1/COST_FACTOR of the time being evaluated
+COST_FACTOR = 20
+# weight of the latest observation in the moving averages of cost and rate of change
+SMOOTHING = 0.5
+
+
+@dataclasses.dataclass
+class CheckState:
+    due: float
+    interval: float
+    current: float = None
+    maximum: float = None
+    updated_at: float = None
+    rate: float = 0.0
+    cost: float = 0.0
+
+    @property
+    def utilization(self) -> typing.Optional[float]:
+        if self.current is None or not self.maximum:
+            return None
+
+        return self.current / self.maximum
+
+
+class AdaptiveScheduler:
+    """Priority queue that decides when to refresh the current value of every check
+
+    The interval of a check shrinks quadratically with its headroom to the limit, i.e. a
+    check at 50% utilization is polled every quarter of max_interval, one at 90% every
+    hundredth. It's shortened further so that a check growing at its current rate can't
+    reach its limit unnoticed and lengthened for checks that are expensive to evaluate.
+    Intervals are always kept between min_interval and max_interval.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.states = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def __push(self, check: QuotaCheck, state: CheckState):
+        heapq.heappush(self._queue, (state.due, next(self._sequence), check))
+
+    def sync(self, checks: typing.Iterable[QuotaCheck]):
+        """Schedules new checks immediately and forgets the ones that aren't passed anymore"""
+        now = time.monotonic()
+        checks = set(checks)
+
+        with self._lock:
+            for check in checks.difference(self.states):
+                self.states[check] = CheckState(due=now, interval=self.min_interval)
+                self.__push(check, self.states[check])
+
+            for check in set(self.states).difference(checks):
+                del self.states[check]
+
+            # drop queue entries of forgotten checks once they pile up
+            if len(self._queue) > 2 * len(self.states):
+                self._queue = [entry for entry in self._queue if entry[2] in self.states]
+                heapq.heapify(self._queue)
+
+    def pop_due(self) -> typing.List[QuotaCheck]:
+        """Removes and returns all checks that are due, they have to be rescheduled afterwards"""
+        now = time.monotonic()
+        due = []
+
+        with self._lock:
+            while self._queue and self._queue[0][0] <= now:
+                due_time, _, check = heapq.heappop(self._queue)
+                state = self.states.get(check)
+
+                if state is not None and state.due == due_time:
+                    due.append(check)
+
+        return due
+
+    def seconds_until_due(self) -> typing.Optional[float]:
+        with self._lock:
+            if not self._queue:
+                return None
+
+            return max(0.0, self._queue[0][0] - time.monotonic())
+
+    def observe_maximum(self, check: QuotaCheck, maximum: float):
+        with self._lock:
+            if check in self.states:
+                self.states[check].maximum = maximum
+
+    def observe_current(self, check: QuotaCheck, current: float, cost: float):
+        """Records the result of a refresh that took cost seconds"""
+        now = time.monotonic()
+
+        with self._lock:
+            state = self.states.get(check)
+
+            if state is None:
+                return
+
+            if state.updated_at is not None and state.maximum and now > state.updated_at:
+                rate = (current - state.current) / state.maximum / (now - state.updated_at)
+                state.rate = SMOOTHING * rate + (1 - SMOOTHING) * state.rate
+
+            state.cost = SMOOTHING * cost + (1 - SMOOTHING) * state.cost if state.updated_at is not None else cost
+            state.current = current
+            state.updated_at = now
+
+    def interval(self, state: CheckState) -> float:
+        utilization = state.utilization
+
+        if utilization is None:
+            return self.min_interval
+
+        headroom = max(0.0, 1.0 - utilization)
+        interval = self.max_interval * headroom ** 2
+
+        if state.rate > 0:
+            # poll at least twice before the limit is reached at the current rate of change
+            interval = min(interval, headroom / state.rate / 2)
+
+        interval = max(interval, state.cost * COST_FACTOR)
+
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def reschedule(self, checks: typing.Iterable[QuotaCheck]):
+        now = time.monotonic()
+
+        with self._lock:
+            for check in checks:
+                state = self.states.get(check)
+
+                if state is None:
+                    continue
+
+                state.interval = self.interval(state)
+                state.due = now + state.interval
+                self.__push(check, state)
+
+    def intervals(self, checks: typing.Iterable[QuotaCheck] = None) -> typing.Dict[QuotaCheck, float]:
+        """Returns the intervals of checks, all scheduled ones by default"""
+        with self._lock:
+            if checks is None:
+                return {check: state.interval for check, state in self.states.items()}
+
+            return {check: self.states[check].interval for check in checks if check in self.states}
@@ -0,0 +1,159 @@
+from aws_quota.check.quota_check import QuotaCheck
+from aws_quota.utils import get_account_id, get_client, paginate, set_account_id
+import functools
+import typing
+
+import boto3
+import botocore.credentials
+import botocore.session
+
+ALL_ENABLED_REGIONS = 'all-enabled'
+ORGANIZATION_ACCOUNTS = 'organization'
+ROLE_SESSION_NAME = 'aws-quota-checker'
+# services whose resources and quotas aren't bound to a region
+GLOBAL_SERVICES = ('iam', 'organizations', 'route53', 's3')
+
+
+class SharedCredentialProvider(botocore.credentials.CredentialProvider):
+    """Hands out the same credentials object to every session it's registered with"""
+    METHOD = 'assume-role'
+
+    def __init__(self, credentials: botocore.credentials.Credentials) -> None:
+        super().__init__()
+        self.credentials = credentials
+
+    def load(self) -> botocore.credentials.Credentials:
+        return self.credentials
+
+
+def get_enabled_regions(session: boto3.Session) -> typing.List[str]:
+    return sorted(region['RegionName'] for region in get_client(session, 'ec2').describe_regions()['Regions'])
+
+
+def get_organization_account_ids(session: boto3.Session) -> typing.List[str]:
+    return [account['Id'] for account in paginate(session, 'organizations', 'list_accounts', 'Accounts')
+            if account['Status'] == 'ACTIVE']
+
+
+def resolve_regions(session: boto3.Session, regions: str = None) -> typing.List[str]:
+    if not regions:
+        return [session.region_name]
+
+    if regions == ALL_ENABLED_REGIONS:
+        return get_enabled_regions(session)
+
+    return [name.strip() for name in regions.split(',') if name.strip()]
+
+
+def resolve_account_ids(session: boto3.Session, accounts: str) -> typing.List[str]:
+    if accounts == ORGANIZATION_ACCOUNTS:
+        return get_organization_account_ids(session)
+
+    return [account_id.strip() for account_id in accounts.split(',') if account_id.strip()]
+
+
+def create_session(region_name: str,
+                   profile: str = None,
+                   data_loader=None,
+                   credentials: botocore.credentials.Credentials = None) -> boto3.Session:
+    botocore_session = botocore.session.Session(profile=profile)
+
+    if data_loader is not None:
+        botocore_session.register_component('data_loader', data_loader)
+
+    if credentials is not None:
+        botocore_session.register_component(
+            'credential_provider',
+            botocore.credentials.CredentialResolver([SharedCredentialProvider(credentials)])
+        )
+
+    return boto3.Session(region_name=region_name, botocore_session=botocore_session)
+
+
+def create_assume_role_credentials(source_session: boto3.Session,
+                                   role_arn: str,
+                                   cache: dict) -> botocore.credentials.Credentials:
+    """Creates credentials that assume role_arn on first use and refresh themselves before they expire"""
+    fetcher = botocore.credentials.AssumeRoleCredentialFetcher(
+        client_creator=functools.partial(source_session._session.create_client,
+                                         region_name=source_session.region_name),
+        source_credentials=source_session.get_credentials(),
+        role_arn=role_arn,
+        extra_args={'RoleSessionName': ROLE_SESSION_NAME},
+        cache=cache
+    )
+
+    return botocore.credentials.DeferredRefreshableCredentials(
+        method='assume-role',
+        refresh_using=fetcher.fetch_credentials
+    )
+
+
+def create_sessions(profile: str = None,
+                    region: str = None,
+                    regions: str = None,
+                    role_name: str = None,
+                    accounts: str = None) -> typing.List[boto3.Session]:
+    """Creates one session per account and region to check
+
+    regions is a comma separated list of region names or all-enabled, if it's not set
+    region is used. If role_name and accounts are set, role_name is assumed in every
+    account of accounts, a comma separated list of account IDs or organization for all
+    active accounts of the AWS Organization. Otherwise only the account of the profile
+    is checked.
+
+    All sessions share botocore's data loader, hence service models are only loaded once
+    per process. Roles are assumed lazily, i.e. in parallel by the workers that use the
+    sessions first, and the credentials are shared by all regions of an account.
+    """
+    source_session = boto3.Session(region_name=region, profile_name=profile)
+    data_loader = source_session._session.get_component('data_loader')
+    region_names = resolve_regions(source_session, regions)
+
+    if not role_name or not accounts:
+        if not regions:
+            return [source_session]
+
+        return [create_session(region_name, profile, data_loader) for region_name in region_names]
+
+    partition = get_client(source_session, 'sts').get_caller_identity()['Arn'].split(':')[1]
+    credential_cache = {}
+    sessions = []
+
+    for account_id in resolve_account_ids(source_session, accounts):
+        credentials = create_assume_role_credentials(
+            source_session,
+            f'arn:{partition}:iam::{account_id}:role/{role_name}',
+            credential_cache
+        )
+
+        for region_name in region_names:
+            session = create_session(region_name, data_loader=data_loader, credentials=credentials)
+            set_account_id(session, account_id)
+            sessions.append(session)
+
+    return sessions
+
+
+def is_global_check(check_class: QuotaCheck) -> bool:
+    """Whether check_class checks a global service, whose resources are the same in every region"""
+    return (check_class.service_code or check_class.key.split('_')[0]) in GLOBAL_SERVICES
+
+
+def get_check_classes_by_session(sessions: typing.List[boto3.Session],
+                                 check_classes: typing.List[QuotaCheck]) -> typing.Dict[boto3.Session, typing.List[QuotaCheck]]:
+    """Returns the check classes to run for every session
+
+    Checks of global services are only run for the first session of every account,
+    otherwise they'd be reported once per region. All other checks run in every region.
+    """
+    regional_check_classes = [chk for chk in check_classes if not is_global_check(chk)]
+    accounts = set()
+    result = {}
+
+    for session in sessions:
+        account_id = get_account_id(session)
+        result[session] = list(check_classes) if account_id not in accounts else list(regional_check_classes)
+        accounts.add(account_id)
+
+    return result
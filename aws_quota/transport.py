@@ -0,0 +1,207 @@
+from aws_quota.rate_limit import rate_limiter
+from aws_quota.utils import SWEEP_CONCURRENCY, get_account_id, get_client, iter_pages, sweep
+import asyncio
+import logging
+import threading
+import typing
+import weakref
+
+import boto3
+import botocore.exceptions
+
+try:
+    import aiobotocore.config
+    import aiobotocore.session
+except ImportError:
+    aiobotocore = None
+
+logger = logging.getLogger(__name__)
+
+BOTO3_TRANSPORT = 'boto3'
+AIOBOTOCORE_TRANSPORT = 'aiobotocore'
+TRANSPORTS = (BOTO3_TRANSPORT, AIOBOTOCORE_TRANSPORT)
+
+
+def error_code(e: Exception) -> typing.Optional[str]:
+    """Returns the AWS error code of e, exception classes differ between boto3 and aiobotocore clients"""
+    return e.response.get('Error', {}).get('Code') if isinstance(e, botocore.exceptions.ClientError) else None
+
+
+class Boto3Transport:
+    """Sends the requests of a sweep with boto3 on up to max_concurrency threads"""
+
+    name = BOTO3_TRANSPORT
+
+    def __init__(self, max_concurrency: int = SWEEP_CONCURRENCY) -> None:
+        self.max_concurrency = max_concurrency
+
+    def fan_out(self,
+                session: boto3.Session,
+                service_name: str,
+                method: str,
+                params: typing.Dict[typing.Hashable, dict],
+                key: str = None,
+                page_size: int = None) -> typing.Tuple[dict, dict]:
+        def send(item):
+            if key is None:
+                return getattr(get_client(session, service_name), method)(**params[item])
+
+            return [result for page in iter_pages(session, service_name, method, page_size, **params[item]) for result in page[key]]
+
+        return sweep(send, params, self.max_concurrency)
+
+    def close(self):
+        pass
+
+
+class AiobotocoreTransport:
+    """Sends the requests of a sweep with aiobotocore on an event loop of its own
+
+    All sweeps share one loop thread and up to max_concurrency requests are in flight at
+    once, no matter how many threads start sweeps. Clients are created per session and
+    service from the session's current credentials and recreated once they're rotated.
+    """
+
+    name = AIOBOTOCORE_TRANSPORT
+
+    def __init__(self, max_concurrency: int = SWEEP_CONCURRENCY, max_attempts: int = 10) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self._session = aiobotocore.session.get_session()
+        # only used on the loop thread
+        self._clients = weakref.WeakKeyDictionary()
+        # serialize creating the client of a session and service, so that concurrent sweeps share one
+        self._client_locks = weakref.WeakKeyDictionary()
+        self._semaphore = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='aiobotocore-transport', daemon=True)
+        self._thread.start()
+
+    def fan_out(self,
+                session: boto3.Session,
+                service_name: str,
+                method: str,
+                params: typing.Dict[typing.Hashable, dict],
+                key: str = None,
+                page_size: int = None) -> typing.Tuple[dict, dict]:
+        # anything that may block, i.e. refreshing credentials and looking up the account ID
+        # for the rate limiter, is done on the calling thread
+        credentials = session.get_credentials().get_frozen_credentials()
+        get_account_id(session)
+
+        return asyncio.run_coroutine_threadsafe(
+            self.__fan_out(session, credentials, service_name, method, params, key, page_size),
+            self._loop
+        ).result()
+
+    async def __client(self, session: boto3.Session, credentials, service_name: str):
+        async with self._client_locks.setdefault(session, {}).setdefault(service_name, asyncio.Lock()):
+            return await self.__create_client(session, credentials, service_name)
+
+    async def __create_client(self, session: boto3.Session, credentials, service_name: str):
+        """Returns the client of session and service, it's created if there's none for credentials yet"""
+        clients = self._clients.setdefault(session, {})
+
+        if service_name in clients and clients[service_name][0] == credentials:
+            return clients[service_name][1]
+
+        if service_name in clients:
+            await clients.pop(service_name)[1].close()
+
+        client = await self._session.create_client(
+            service_name,
+            region_name=session.region_name,
+            aws_access_key_id=credentials.access_key,
+            aws_secret_access_key=credentials.secret_key,
+            aws_session_token=credentials.token,
+            config=aiobotocore.config.AioConfig(
+                max_pool_connections=self.max_concurrency,
+                retries={'mode': 'standard', 'max_attempts': self.max_attempts}
+            )
+        ).__aenter__()
+
+        session_ref = weakref.ref(session)
+        rate_limiter.register_async(client, service_name, lambda: get_account_id(session_ref()))
+        clients[service_name] = (credentials, client)
+
+        return client
+
+    async def __fan_out(self, session, credentials, service_name, method, params, key, page_size) -> typing.Tuple[dict, dict]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        client = await self.__client(session, credentials, service_name)
+
+        async def send(item):
+            async with self._semaphore:
+                if key is None:
+                    return await getattr(client, method)(**params[item])
+
+                pagination_config = {'PageSize': page_size} if page_size is not None else {}
+                return [result
+                        async for page in client.get_paginator(method).paginate(PaginationConfig=pagination_config, **params[item])
+                        for result in page[key]]
+
+        items = list(params)
+        outcomes = await asyncio.gather(*(send(item) for item in items), return_exceptions=True)
+        results, errors = {}, {}
+
+        for item, outcome in zip(items, outcomes):
+            if isinstance(outcome, BaseException):
+                errors[item] = outcome
+            else:
+                results[item] = outcome
+
+        return results, errors
+
+    async def __close(self):
+        for clients in list(self._clients.values()):
+            for _, client in clients.values():
+                await client.close()
+
+        self._clients.clear()
+        self._client_locks.clear()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.__close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_transport = Boto3Transport()
+
+
+def configure_transport(name: str = BOTO3_TRANSPORT, max_concurrency: int = SWEEP_CONCURRENCY, max_attempts: int = 10):
+    """Sets the transport of the sweeps that send one request per resource, e.g. per SNS topic
+
+    aiobotocore is optional, boto3 is used if it isn't installed. Returns the transport,
+    its name is the one of the transport actually used.
+    """
+    global _transport
+
+    if name == AIOBOTOCORE_TRANSPORT and aiobotocore is None:
+        logger.warning('aiobotocore is not installed, falling back to the boto3 transport')
+        name = BOTO3_TRANSPORT
+
+    _transport.close()
+
+    if name == AIOBOTOCORE_TRANSPORT:
+        _transport = AiobotocoreTransport(max_concurrency, max_attempts)
+    else:
+        _transport = Boto3Transport(max_concurrency)
+
+    return _transport
+
+
+def fan_out(session: boto3.Session,
+            service_name: str,
+            method: str,
+            params: typing.Dict[typing.Hashable, dict],
+            key: str = None,
+            page_size: int = None) -> typing.Tuple[dict, dict]:
+    """Sends method once per item of params with the item's parameters
+
+    Returns the responses, or if key is given the items stored under key of all result
+    pages, and the exceptions raised keyed by item, so that a failing request doesn't
+    affect the others.
+    """
+    return _transport.fan_out(session, service_name, method, params, key, page_size)
@@ -1,7 +1,127 @@
-import functools
+from aws_quota.rate_limit import rate_limiter
+import concurrent.futures
+import threading
+import typing
+import weakref
+
 import boto3
+import botocore.client
+import botocore.config
+
+_client_config = botocore.config.Config(
+    max_pool_connections=10,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 10}
+)
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+_account_ids = weakref.WeakKeyDictionary()
+_account_ids_lock = threading.Lock()
+
+# number of parallel requests of per-resource sweeps, stays below the default connection pool size
+SWEEP_CONCURRENCY = 8
+
+
+def configure_clients(max_pool_connections: int = 10, tcp_keepalive: bool = True, max_attempts: int = 10):
+    """Sets the botocore configuration shared by all clients handed out by get_client
+
+    Clients that have been created with a previous configuration are discarded.
+    """
+    global _client_config
+
+    with _clients_lock:
+        _client_config = botocore.config.Config(
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=tcp_keepalive,
+            retries={'mode': 'adaptive', 'max_attempts': max_attempts}
+        )
+        _clients.clear()
+
+
+def get_client(session: boto3.Session, service_name: str, region_name: str = None) -> botocore.client.BaseClient:
+    """Returns a client for the given service that is shared per session and region
+
+    boto3 clients are thread-safe, sessions are not, hence client creation is serialized.
+    Requests of the clients are rate limited per account, region and API operation.
+    """
+    key = (service_name, region_name or session.region_name)
+
+    with _clients_lock:
+        clients = _clients.setdefault(session, {})
+
+        if key not in clients:
+            client = session.client(service_name, region_name=region_name, config=_client_config)
+
+            # STS is needed to look up the account ID of the rate limit itself
+            if service_name != 'sts':
+                session_ref = weakref.ref(session)
+                rate_limiter.register(client, service_name, lambda: get_account_id(session_ref()))
+
+            clients[key] = client
+
+        return clients[key]
+
+
+def iter_pages(session: boto3.Session, service_name: str, method: str, page_size: int = None, **kwargs) -> typing.Iterator[dict]:
+    """Yields the result pages of an AWS API operation one after another
+
+    Operations that botocore can't paginate are called once. kwargs are passed to the
+    operation, e.g. to apply server-side filters.
+    """
+    client = get_client(session, service_name)
+
+    if not client.can_paginate(method):
+        yield getattr(client, method)(**kwargs)
+        return
+
+    pagination_config = {'PageSize': page_size} if page_size is not None else {}
+
+    yield from client.get_paginator(method).paginate(PaginationConfig=pagination_config, **kwargs)
+
+
+def paginate(session: boto3.Session, service_name: str, method: str, key: str, page_size: int = None, **kwargs) -> typing.Iterator[dict]:
+    """Yields the items stored under key of all result pages"""
+    for page in iter_pages(session, service_name, method, page_size, **kwargs):
+        yield from page[key]
+
+
+def count_paginated(session: boto3.Session, service_name: str, method: str, key: str, page_size: int = None, **kwargs) -> int:
+    """Counts the items stored under key of all result pages without keeping the pages in memory"""
+    return sum(len(page[key]) for page in iter_pages(session, service_name, method, page_size, **kwargs))
+
+
+def sweep(func: typing.Callable, items: typing.Iterable, max_workers: int = SWEEP_CONCURRENCY) -> typing.Tuple[dict, dict]:
+    """Calls func for every item on up to max_workers threads
+
+    Returns the results and the exceptions raised by func keyed by item, so that a failure
+    for one item doesn't affect the others.
+    """
+    results, errors = {}, {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(func, item): item for item in items}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                errors[futures[future]] = e
+
+    return results, errors
+
+
+def set_account_id(session: boto3.Session, account_id: str):
+    """Registers the account ID of a session, e.g. when it's known from an assumed role"""
+    with _account_ids_lock:
+        _account_ids[session] = account_id
 
 
-@functools.lru_cache()
 def get_account_id(session: boto3.Session) -> str:
-    return session.client('sts').get_caller_identity()['Account']
\ No newline at end of file
+    with _account_ids_lock:
+        if session in _account_ids:
+            return _account_ids[session]
+
+    account_id = get_client(session, 'sts').get_caller_identity()['Account']
+    set_account_id(session, account_id)
+
+    return account_id
@@ -27,6 +27,9 @@ setup(
         },
         'prometheus':{
             'prometheus-client'
+        },
+        'async':{
+            'aiobotocore'
         }
     },
     entry_points='''
@@ -0,0 +1,43 @@
+import resource
+import sys
+import time
+
+import boto3
+
+from aws_quota.check.vpc import RulesPerSecurityGroupCheck
+
+try:
+    from aws_quota.utils import get_client
+except ImportError:
+    # trees without the client pool create a client wherever one is needed
+    def get_client(session, service_name):
+        return session.client(service_name)
+
+# runs against any tree, e.g. git worktree add /tmp/before dae2ccb~1 && cd /tmp/before && PYTHONPATH=. python .../benchmark-clients.py
+checks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+# construct only, trees without the pool need about 1.5 GiB per 1k resolved clients
+construct_only = len(sys.argv) > 2 and sys.argv[2] == 'construct'
+
+
+def rss() -> float:
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+session = boto3.Session(region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+baseline = rss()
+
+start = time.perf_counter()
+instances = [RulesPerSecurityGroupCheck(session, f'sg-{i:08x}') for i in range(checks)]
+construction = time.perf_counter() - start
+print(f'constructed {checks} checks in {construction:.2f}s, RSS +{rss() - baseline:.0f} MiB')
+
+if construct_only:
+    sys.exit()
+
+# the clients the current properties resolve on every evaluation
+start = time.perf_counter()
+clients = [get_client(check.boto_session, 'ec2') for check in instances]
+resolution = time.perf_counter() - start
+print(f'resolved {len(clients)} ec2 clients ({len(set(map(id, clients)))} distinct) in {resolution:.2f}s, '
+      f'RSS +{rss() - baseline:.0f} MiB, peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB')
@@ -0,0 +1,38 @@
+import http.server
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+
+from aws_quota.prometheus import MetricsHandler, ResultsCollector
+
+series = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+scrapes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+collector = ResultsCollector()
+
+start = time.perf_counter()
+for i in range(series):
+    collector.set(f'awsquota_benchmark_{i % 50}', 'Benchmark series',
+                  {'account': '123456789012', 'region': 'eu-west-1', 'instance': f'sg-{i:08x}'}, i)
+collector.publish()
+print(f'published {series} series in {time.perf_counter() - start:.3f}s')
+
+server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MetricsHandler)
+server.collector = collector
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+for encoding in ['identity', 'gzip']:
+    durations = []
+
+    for _ in range(scrapes):
+        request = urllib.request.Request(f'http://127.0.0.1:{server.server_port}/metrics',
+                                         headers={'Accept-Encoding': encoding})
+        start = time.perf_counter()
+        size = len(urllib.request.urlopen(request).read())
+        durations.append(time.perf_counter() - start)
+
+    print(f'{encoding}: median scrape {statistics.median(durations) * 1000:.1f}ms, {size} bytes')
+
+server.shutdown()
@@ -0,0 +1,60 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+import boto3
+
+from aws_quota.transport import TRANSPORTS, configure_transport, fan_out
+from aws_quota.utils import configure_clients, paginate, set_account_id
+
+# run against a local moto server, e.g. moto_server -p 5000 and AWS_ENDPOINT_URL=http://127.0.0.1:5000
+if 'AWS_ENDPOINT_URL' not in os.environ:
+    sys.exit('AWS_ENDPOINT_URL has to point to a local endpoint, e.g. a moto server')
+
+topics = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+transports = sys.argv[3].split(',') if len(sys.argv) > 3 else TRANSPORTS
+
+session = boto3.Session(region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing')
+set_account_id(session, '123456789012')
+configure_clients(max_pool_connections=concurrency)
+
+client = session.client('sns')
+for i in range(len(list(paginate(session, 'sns', 'list_topics', 'Topics'))), topics):
+    client.create_topic(Name=f'benchmark-{i}')
+
+params = {topic['TopicArn']: {'TopicArn': topic['TopicArn']} for topic in paginate(session, 'sns', 'list_topics', 'Topics')}
+print(f'{len(params)} topics, {concurrency} concurrent requests')
+
+for name in transports:
+    transport = configure_transport(name, concurrency)
+
+    if transport.name != name:
+        print(f'{name}: not installed')
+        continue
+
+    peak_threads = threading.active_count()
+    done = threading.Event()
+
+    def sample():
+        global peak_threads
+
+        while not done.wait(0.01):
+            peak_threads = max(peak_threads, threading.active_count())
+
+    threading.Thread(target=sample, daemon=True).start()
+
+    start = time.perf_counter()
+    results, errors = fan_out(session, 'sns', 'get_topic_attributes', params)
+    duration = time.perf_counter() - start
+    done.set()
+
+    print(f'{name}: {len(results)} requests in {duration:.2f}s, {len(results) / duration:.0f} requests/s, '
+          f'{len(errors)} errors, {peak_threads} threads at peak')
+
+    for error, count in collections.Counter(type(e).__name__ for e in errors.values()).most_common():
+        print(f'  {count} {error}')
+
+configure_transport()
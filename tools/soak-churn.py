@@ -0,0 +1,86 @@
+import asyncio
+import itertools
+import logging
+import statistics
+import sys
+import tracemalloc
+
+import boto3
+
+from aws_quota.check.quota_check import InstanceQuotaCheck
+from aws_quota.exceptions import InstanceWithIdentifierNotFound
+from aws_quota.prometheus import PrometheusExporter, PrometheusExporterSettings
+from aws_quota.utils import set_account_id
+
+instances = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+duration = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+counter = itertools.count()
+identifiers = [f'sg-{next(counter)}' for _ in range(instances)]
+
+
+class ChurningCheck(InstanceQuotaCheck):
+    """Every discovery replaces a tenth of the instances, a few vanish between discoveries"""
+    key = 'soak_churn'
+    description = 'Soak test instances'
+    service_code = 'soak'
+    quota_code = 'L-SOAK'
+
+    @staticmethod
+    def get_all_identifiers(session):
+        replaced = instances // 10
+        del identifiers[:replaced]
+        identifiers.extend(f'sg-{next(counter)}' for _ in range(replaced))
+        return list(identifiers)
+
+    @property
+    def current(self):
+        if int(self.instance_id[3:]) % 97 == 0:
+            raise InstanceWithIdentifierNotFound(self)
+        return 1
+
+    @property
+    def maximum(self):
+        return 10
+
+
+async def soak(exporter: PrometheusExporter):
+    jobs = asyncio.ensure_future(exporter.background_jobs())
+    samples = []
+
+    for second in range(duration):
+        await asyncio.sleep(1)
+        current, _ = tracemalloc.get_traced_memory()
+        samples.append((exporter.results.series_count(), current))
+        print(f'{second + 1:4d}s series={samples[-1][0]} memory={current / 2 ** 20:.1f}MiB')
+
+    jobs.cancel()
+    return samples
+
+
+logging.basicConfig(level=logging.ERROR)
+session = boto3.Session(region_name='eu-west-1')
+set_account_id(session, '123456789012')
+
+exporter = PrometheusExporter([session], [ChurningCheck], PrometheusExporterSettings(
+    port=0,
+    namespace='soak',
+    get_currents_interval=0,
+    get_limits_interval=0,
+    reload_checks_interval=0,
+    enable_duration_metrics=True,
+    publish_interval=0
+))
+
+tracemalloc.start()
+samples = asyncio.run(soak(exporter))
+
+# value, limit and interval series per instance plus a few exporter metrics
+assert max(series for series, _ in samples) <= 3 * instances + 20, 'series are leaking'
+
+# samples taken while a render is in flight are higher, hence compare the medians of the second and last third
+third = len(samples) // 3
+settled, last = [memory for _, memory in samples[third:2 * third]], [memory for _, memory in samples[2 * third:]]
+assert statistics.median(last) <= 1.5 * statistics.median(settled), 'memory is growing'
+
+print('series and memory stayed bounded')
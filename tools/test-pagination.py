@@ -0,0 +1,59 @@
+import datetime
+import sys
+
+import boto3
+from botocore.stub import Stubber
+
+from aws_quota.check.cloudformation import StackCountCheck, get_undeleted_stack_statuses
+from aws_quota.check.dynamodb import TableCountCheck
+from aws_quota.check.ebs import SnapshotCountCheck
+from aws_quota.check.secretsmanager import SecretCountCheck
+from aws_quota.utils import get_client, set_account_id
+
+# checks answered by a stubbed client with multi-page responses, every request has to carry
+# the filters and page size of the check and the token of the previous page
+session = boto3.Session(region_name='eu-west-1', aws_access_key_id='AKIATESTEXAMPLE', aws_secret_access_key='test')
+set_account_id(session, '123456789012')
+
+CASES = [
+    (SnapshotCountCheck, 'ec2', 'describe_snapshots', 'Snapshots', 'NextToken', 'NextToken',
+     {'OwnerIds': ['self'], 'MaxResults': 1000}, 100, 1000, lambda i: {'SnapshotId': f'snap-{i:08x}'}),
+    (StackCountCheck, 'cloudformation', 'list_stacks', 'StackSummaries', 'NextToken', 'NextToken',
+     {'StackStatusFilter': get_undeleted_stack_statuses(session)}, 5, 100,
+     lambda i: {'StackName': f'stack-{i}', 'CreationTime': datetime.datetime(2021, 1, 1), 'StackStatus': 'CREATE_COMPLETE'}),
+    (TableCountCheck, 'dynamodb', 'list_tables', 'TableNames', 'ExclusiveStartTableName', 'LastEvaluatedTableName',
+     {}, 5, 100, lambda i: f'table-{i:05d}'),
+    (SecretCountCheck, 'secretsmanager', 'list_secrets', 'SecretList', 'NextToken', 'NextToken',
+     {}, 5, 100, lambda i: {'Name': f'secret-{i}'})
+]
+
+failures = 0
+
+for check_class, service_name, method, key, input_token, output_token, params, pages, page_size, make in CASES:
+    stubber = Stubber(get_client(session, service_name))
+    token = None
+
+    for page in range(pages):
+        items = [make(page * page_size + i) for i in range(page_size)]
+        response = {key: items}
+        expected_params = dict(params)
+
+        if token is not None:
+            expected_params[input_token] = token
+
+        if page < pages - 1:
+            token = items[-1] if isinstance(items[-1], str) else f'token-{page}'
+            response[output_token] = token
+
+        stubber.add_response(method, response, expected_params)
+
+    with stubber:
+        current = check_class(session).current
+        stubber.assert_no_pending_responses()
+
+    expected = pages * page_size
+    failures += current != expected
+    print(f'{check_class.key}: {current} of {expected} items in {pages} pages{"" if current == expected else " FAILED"}')
+
+if failures:
+    sys.exit(f'{failures} checks counted the wrong number of items')